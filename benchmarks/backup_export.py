@@ -0,0 +1,79 @@
+"""Compare backup export throughput and on-disk size across compression settings.
+
+Run from the repository root:
+
+    python benchmarks/backup_export.py --documents 20000
+
+The json/none row is the plain Extended JSON lines format written before compressed backups existed.
+BSON rows encode the documents up front, the way RawBSONDocuments arrive from the server, and also
+time reading the file back.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resume_compiler'))
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from database.backup_formats import backup_file_name, read_raw_bson, write_json_lines, write_raw_bson, zstandard
+
+WORDS = [''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 10))) for _ in range(2000)]
+
+def make_job_posting(index: int) -> dict:
+    return {
+        '_id': ObjectId(),
+        'job_id': str(3900000000 + index),
+        'company': random.choice(WORDS).title(),
+        'role': ' '.join(random.choices(WORDS, k=3)).title(),
+        'city': 'Toronto, ON',
+        'description': ' '.join(random.choices(WORDS, k=450)),
+        'skills': [random.choice(WORDS) for _ in range(15)],
+        'stage': 'skills_ready',
+        'general': False,
+        'tailored': False,
+    }
+
+def run(documents: list, backup_format: str, compression: str, level: int, output_dir: str) -> tuple:
+    file_path = os.path.join(output_dir, backup_file_name(f'bench_{compression}_{level}', compression, backup_format))
+    write = write_raw_bson if backup_format == 'bson' else write_json_lines
+    start = perf_counter()
+    entry = write(documents, file_path, compression, level)
+    elapsed = perf_counter() - start
+    os.remove(file_path)
+    return elapsed, entry['size']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=20000)
+    args = parser.parse_args()
+
+    documents = [make_job_posting(i) for i in range(args.documents)]
+    raw_documents = [RawBSONDocument(bson.encode(document)) for document in documents]
+    settings = [('none', 0), ('gzip', 1), ('gzip', 6)]
+    if zstandard is not None:
+        settings += [('zstd', 3), ('zstd', 9)]
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        baseline_size = None
+        print(f"{'format':<8}{'compression':<13}{'level':>6}{'docs/s':>12}{'MB/s':>10}{'size MB':>10}{'ratio':>8}")
+        for backup_format, docs in (('json', documents), ('bson', raw_documents)):
+            for compression, level in settings:
+                elapsed, size = run(docs, backup_format, compression, level, output_dir)
+                baseline_size = baseline_size or size
+                print(f"{backup_format:<8}{compression:<13}{level:>6}{len(docs) / elapsed:>12.0f}"
+                      f"{baseline_size / elapsed / 1e6:>10.1f}{size / 1e6:>10.2f}{baseline_size / size:>8.1f}")
+
+        file_path = os.path.join(output_dir, backup_file_name('bench_read', 'none', 'bson'))
+        write_raw_bson(raw_documents, file_path)
+        start = perf_counter()
+        count = sum(1 for _ in read_raw_bson(file_path))
+        print(f"bson mmap read: {count / (perf_counter() - start):.0f} docs/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Measure the per-call overhead of a fresh OpenAI client versus the shared pooled client.
+
+Run from the repository root:
+
+    python benchmarks/openai_client.py --calls 200
+
+Calls go to a local stub of the chat completions endpoint, so the numbers are client and
+connection overhead only. The stub speaks plain HTTP; against the real API each new client
+also pays a TLS handshake, which makes the difference larger.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resume_compiler'))
+
+COMPLETION = json.dumps({
+    'id': 'chatcmpl-stub',
+    'object': 'chat.completion',
+    'created': 0,
+    'model': 'gpt-4o-mini',
+    'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'ok'}}],
+    'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+}).encode('utf-8')
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def fresh_client_call(openai_operations):
+    """The previous behaviour: a new client, and so a new connection pool, for every call."""
+    client = openai_operations.OpenAI(api_key=openai_operations.get_openai_api_key())
+    client.chat.completions.create(model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'hi'}])
+    client.close()
+
+def shared_client_call(openai_operations):
+    openai_operations.get_openai_client().chat.completions.create(
+        model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'hi'}]
+    )
+
+def time_calls(call, openai_operations, calls: int) -> float:
+    call(openai_operations)  # warm up
+    start = perf_counter()
+    for _ in range(calls):
+        call(openai_operations)
+    return (perf_counter() - start) / calls
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    server = start_stub_server()
+    os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    from ai import openai_operations
+
+    fresh = time_calls(fresh_client_call, openai_operations, args.calls)
+    shared = time_calls(shared_client_call, openai_operations, args.calls)
+    print(f"{'client':<10}{'ms/call':>10}")
+    print(f"{'fresh':<10}{fresh * 1000:>10.2f}")
+    print(f"{'shared':<10}{shared * 1000:>10.2f}")
+    print(f"overhead saved per call: {(fresh - shared) * 1000:.2f} ms ({fresh / shared:.1f}x)")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Measure SkillMatcher index build, incremental add and top-k search over a large skill vocabulary.
+
+Run from the repository root:
+
+    python benchmarks/skill_matcher.py --skills 20000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resume_compiler'))
+
+from utils.skill_matcher import SkillMatcher
+
+def make_skill() -> str:
+    words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))) for _ in range(random.randint(1, 3))]
+    return ' '.join(words)
+
+def misspell(skill: str) -> str:
+    position = random.randrange(len(skill))
+    return skill[:position] + random.choice(string.ascii_lowercase) + skill[position + 1:]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--skills', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    skills = list({make_skill() for _ in range(args.skills)})
+    targets = [random.choice(skills) for _ in range(args.queries)]
+    queries = [misspell(skill) for skill in targets]
+
+    start = perf_counter()
+    matcher = SkillMatcher(skills)
+    matcher.search(queries[0], args.k)
+    print(f"build + first search: {(perf_counter() - start) * 1000:.0f} ms for {len(matcher)} skills")
+
+    start = perf_counter()
+    for skill in (make_skill() for _ in range(100)):
+        matcher.add(skill)
+    matcher.search(queries[0], args.k)
+    print(f"add 100 skills one by one + refresh: {(perf_counter() - start) * 1000:.0f} ms")
+
+    start = perf_counter()
+    correct = 0
+    for query, target in zip(queries, targets):
+        results = matcher.search(query, args.k)
+        correct += bool(results) and results[0][0] == target
+    elapsed = perf_counter() - start
+    print(f"search: {elapsed / len(queries) * 1000:.2f} ms/query (top {args.k}), "
+          f"{correct}/{len(queries)} one-character typos matched to the original skill")
+
+if __name__ == '__main__':
+    main()
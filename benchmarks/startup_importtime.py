@@ -0,0 +1,73 @@
+"""Measure how long importing main takes with -X importtime and fail when it exceeds a budget.
+
+Run from the repository root:
+
+    python benchmarks/startup_importtime.py --budget-ms 500
+
+main is imported in a fresh interpreter without OPENAI_API_KEY, the way a run starts. The check also
+fails when a stage's heavy dependency is loaded on startup, since that is usually how startup regresses:
+a module-level import that should have stayed inside its stage.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Packages only the scraping, AI and resume stages need.
+STAGE_ONLY_PACKAGES = ('scrapy', 'twisted', 'playwright', 'openai', 'tiktoken', 'dotenv', 'docx', 'PIL', 'numpy')
+
+def measure_import() -> list:
+    """Import main once in a fresh interpreter and return (module, self us, cumulative us) rows."""
+    env = {key: value for key, value in os.environ.items() if key != 'OPENAI_API_KEY'}
+    env['PYTHONPATH'] = os.path.join(REPOSITORY_ROOT, 'resume_compiler')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=REPOSITORY_ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import main failed:\n{result.stderr}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        rows.append((module.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=500)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    # The first import also writes bytecode caches, so it is not counted.
+    measure_import()
+    runs = [measure_import() for _ in range(args.runs)]
+    totals = [next(cumulative for module, _, cumulative in rows if module == 'main') / 1000 for rows in runs]
+    median = statistics.median(totals)
+
+    package_times = Counter()
+    for module, self_us, _ in runs[-1]:
+        package_times[module.split('.')[0]] += self_us
+    print(f"{'package':<24}{'self ms':>10}")
+    for package, self_us in package_times.most_common(args.top):
+        print(f"{package:<24}{self_us / 1000:>10.1f}")
+    print(f"import main: median {median:.0f} ms over {args.runs} runs (min {min(totals):.0f}, max {max(totals):.0f}), budget {args.budget_ms:.0f} ms")
+
+    loaded = sorted({module.split('.')[0] for module, _, _ in runs[-1]} & set(STAGE_ONLY_PACKAGES))
+    failed = False
+    if loaded:
+        print(f"FAIL: stage-only packages imported on startup: {', '.join(loaded)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: startup exceeds the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
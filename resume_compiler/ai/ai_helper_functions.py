@@ -1,20 +1,57 @@
 import json
-import tiktoken
+from difflib import SequenceMatcher
+from functools import lru_cache
 
 def load_prompts():
     with open('resume_compiler/ai/prompts.json', 'r') as f:
         return json.load(f)
     
-def fit_prompts(system_prompt: str, user_prompt: str, encoding_name, max_tokens=128000):
-    encoding = tiktoken.encoding_for_model(encoding_name)
-    tokens1 = encoding.encode(system_prompt)
-    tokens2 = encoding.encode(user_prompt)
-    total_tokens = len(tokens1) + len(tokens2)
-    if total_tokens > max_tokens:
-        tokens_to_remove = total_tokens - max_tokens
-        if len(tokens2) > tokens_to_remove:
-            tokens2 = tokens2[:len(tokens2) - tokens_to_remove]
-        else:
-            tokens2 = []
-        user_prompt = encoding.decode(tokens2)
-    return system_prompt, user_prompt
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Return the tiktoken encoding of a model, loading it once per process."""
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
+
+def count_tokens(text: str, model: str) -> int:
+    return len(get_encoding(model).encode(text))
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for pacing, about four bytes of text per token."""
+    return len(text.encode('utf-8')) // 4 + 1
+
+def fit_prompt(user_prompt: str, max_tokens: int, model: str) -> tuple:
+    """Truncate a prompt to at most max_tokens tokens. Returns the prompt and its token count, or None
+    for the count when the prompt was short enough to skip tokenizing.
+
+    Every token covers at least one byte, so a prompt with no more bytes than max_tokens always fits.
+    Long prompts only have a prefix encoded, since the tokens past the budget are dropped anyway."""
+    if len(user_prompt) * 4 <= max_tokens or len(user_prompt.encode('utf-8')) <= max_tokens:
+        return user_prompt, None
+
+    encoding = get_encoding(model)
+    prefix = user_prompt[:max_tokens * 8]
+    tokens = encoding.encode(prefix)
+    if len(tokens) <= max_tokens and len(prefix) < len(user_prompt):
+        tokens = encoding.encode(user_prompt)
+    if len(tokens) <= max_tokens:
+        return user_prompt, len(tokens)
+    return encoding.decode(tokens[:max_tokens]), max_tokens
+
+def dedupe_candidates(candidates: list, threshold: float = 0.9) -> list:
+    """Drop candidates that are near-identical to an earlier one, ignoring case and spacing."""
+    kept, normalized = [], []
+    for candidate in candidates:
+        if candidate is None:
+            continue
+        text = ' '.join(candidate.lower().split())
+        matcher = SequenceMatcher(None, b=text)
+        duplicate = False
+        for other in normalized:
+            matcher.set_seq1(other)
+            if matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(candidate)
+            normalized.append(text)
+    return kept
@@ -0,0 +1,190 @@
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from ai.completion_cache import get_completion_cache, make_cache_key
+from ai.openai_operations import SKILLS_COUNT, SKILLS_RESPONSE_FORMAT, fit_user_prompt, get_openai_client, parse_string_list, prompts
+from config.settings import load_config
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+BATCH_FINISHED = ('completed', 'failed', 'expired', 'cancelled')
+# Error codes of requests a batch never ran before it expired or was cancelled; they can be submitted again.
+UNFINISHED_REQUEST_CODES = ('batch_expired', 'batch_cancelled')
+SKILLS_MODEL = 'gpt-4o-mini'
+SKILLS_TEMPERATURE = 0.4
+
+def load_batch_config() -> dict:
+    """Load Batch API settings, falling back to defaults for missing keys."""
+    config = load_config()
+    return {
+        'enabled': config.getboolean('OPENAI', 'batch_mode', fallback=False),
+        'min_postings': config.getint('OPENAI', 'batch_min_postings', fallback=100),
+        'state_file': config.get('OPENAI', 'batch_state_file', fallback='cache/skills_batch.json'),
+        'wait_seconds': config.getint('OPENAI', 'batch_wait_seconds', fallback=0),
+        'poll_interval': config.getint('OPENAI', 'batch_poll_interval_seconds', fallback=60),
+    }
+
+def load_batch_state(state_file: str) -> dict:
+    """Return the batch submitted by an earlier run, or None."""
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as file:
+        return json.load(file)
+
+def save_batch_state(state_file: str, state: dict):
+    """Atomically record the submitted batch so a later run can pick up its results."""
+    directory = os.path.dirname(state_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{state_file}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_path, state_file)
+
+def clear_batch_state(state_file: str):
+    if os.path.exists(state_file):
+        os.remove(state_file)
+
+def build_batch_request(job_id: str, description: str) -> dict:
+    """Build one Batch API request line, identified by the job id it belongs to."""
+    return {
+        'custom_id': job_id,
+        'method': 'POST',
+        'url': BATCH_ENDPOINT,
+        'body': {
+            'model': SKILLS_MODEL,
+            'temperature': SKILLS_TEMPERATURE,
+            'response_format': SKILLS_RESPONSE_FORMAT,
+            'messages': [
+                {'role': 'system', 'content': prompts['skills_analysis']},
+                {'role': 'user', 'content': fit_user_prompt('skills_analysis', description, SKILLS_MODEL)[0]},
+            ],
+        },
+    }
+
+def submit_skills_batch(job_descriptions, state_file: str) -> dict:
+    """Upload skills analysis requests for (job_id, description) pairs as JSONL and start a batch.
+    Returns the saved batch state, or None when there is nothing to submit."""
+    client = get_openai_client()
+    buffer = io.BytesIO()
+    job_ids = []
+    for job_id, description in job_descriptions:
+        buffer.write(json.dumps(build_batch_request(job_id, description)).encode('utf-8') + b'\n')
+        job_ids.append(job_id)
+    if not job_ids:
+        return None
+
+    input_file = client.files.create(file=('skills_analysis.jsonl', buffer.getvalue()), purpose='batch')
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window='24h',
+        metadata={'prompt': 'skills_analysis'},
+    )
+    state = {
+        'batch_id': batch.id,
+        'input_file_id': input_file.id,
+        'job_ids': job_ids,
+        'submitted_at': datetime.now().isoformat(),
+    }
+    save_batch_state(state_file, state)
+    logger.info(f"Submitted skills analysis batch {batch.id} for {len(job_ids)} job postings.")
+    return state
+
+def wait_for_batch(batch_id: str, wait_seconds: int, poll_interval: int):
+    """Poll a batch until it finishes or wait_seconds pass, and return its latest status."""
+    client = get_openai_client()
+    deadline = time.monotonic() + wait_seconds
+    batch = client.batches.retrieve(batch_id)
+    while batch.status not in BATCH_FINISHED and time.monotonic() < deadline:
+        time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+        batch = client.batches.retrieve(batch_id)
+    return batch
+
+def read_batch_file(file_id: str):
+    """Yield the records of a batch output or error file."""
+    for line in get_openai_client().files.content(file_id).text.splitlines():
+        if line.strip():
+            yield json.loads(line)
+
+def read_batch_results(batch) -> tuple:
+    """Read a finished batch's output and error files, whatever its status: an expired or cancelled
+    batch still holds the requests it finished.
+
+    Returns the successful responses as raw completion text keyed by job id, and the job ids of requests
+    that failed. Requests the batch never ran are in neither, so they can be submitted again."""
+    results = {}
+    failed_job_ids = set()
+    records = []
+    if batch.output_file_id:
+        records.extend(read_batch_file(batch.output_file_id))
+    if batch.error_file_id:
+        records.extend(read_batch_file(batch.error_file_id))
+
+    for record in records:
+        job_id = record.get('custom_id')
+        response = record.get('response') or {}
+        if not record.get('error') and response.get('status_code') == 200:
+            results[job_id] = response['body']['choices'][0]['message']['content']
+            continue
+        error = record.get('error') or (response.get('body') or {}).get('error')
+        if isinstance(error, dict) and error.get('code') in UNFINISHED_REQUEST_CODES:
+            continue
+        logger.warning(f"Batch request for job id {job_id} failed: {error or response.get('status_code')}")
+        failed_job_ids.add(job_id)
+    return results, failed_job_ids
+
+def cache_batch_results(results: dict, load_descriptions):
+    """Store batch results under the keys regular skills analysis requests use, so a run interrupted
+    after the batch state is cleared still finds them."""
+    cache = get_completion_cache()
+    if cache is None:
+        return
+    for job_id, description in load_descriptions(list(results)):
+        user_prompt, _ = fit_user_prompt('skills_analysis', description, SKILLS_MODEL)
+        key = make_cache_key('skills_analysis', prompts['skills_analysis'], user_prompt, SKILLS_MODEL, SKILLS_TEMPERATURE, SKILLS_RESPONSE_FORMAT)
+        cache.set(key, 'skills_analysis', SKILLS_MODEL, results[job_id])
+
+def skills_analysis_batch(job_ids: list, load_descriptions) -> tuple:
+    """Run skills analysis for a large backlog through the Batch API.
+
+    Submits a new batch when the backlog reaches batch_min_postings, or resumes the batch an earlier run
+    submitted. Returns the skills lists of the finished requests keyed by job id and the job ids still
+    waiting in a running batch.
+    load_descriptions(job_ids) must yield (job_id, description) pairs."""
+    config = load_batch_config()
+    state = load_batch_state(config['state_file'])
+
+    if state is None:
+        if len(job_ids) < config['min_postings']:
+            return {}, set()
+        state = submit_skills_batch(load_descriptions(job_ids), config['state_file'])
+        if state is None:
+            return {}, set()
+
+    batch = wait_for_batch(state['batch_id'], config['wait_seconds'], config['poll_interval'])
+    if batch.status not in BATCH_FINISHED:
+        logger.info(f"Skills analysis batch {batch.id} is {batch.status}; {len(state['job_ids'])} job postings will be collected by a later run.")
+        return {}, set(state['job_ids'])
+
+    results, failed_job_ids = read_batch_results(batch)
+    logger.info(f"Collected {len(results)} of {len(state['job_ids'])} results from skills analysis batch {batch.id}, which ended as {batch.status}.")
+    cache_batch_results(results, load_descriptions)
+    clear_batch_state(config['state_file'])
+
+    # Requests the batch never ran go into a new batch when there are enough of them; the rest, and
+    # requests that failed, fall back to regular requests.
+    current_job_ids = set(job_ids)
+    unfinished = [job_id for job_id in state['job_ids'] if job_id in current_job_ids and job_id not in results and job_id not in failed_job_ids]
+    pending_job_ids = set()
+    if len(unfinished) >= config['min_postings']:
+        resubmitted = submit_skills_batch(load_descriptions(unfinished), config['state_file'])
+        pending_job_ids = set(resubmitted['job_ids']) if resubmitted else set()
+
+    skills = {job_id: parse_string_list('skills_analysis', content, 'skills', SKILLS_COUNT) for job_id, content in results.items()}
+    return {job_id: job_skills for job_id, job_skills in skills.items() if job_skills is not None}, pending_job_ids
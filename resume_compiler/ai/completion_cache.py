@@ -0,0 +1,155 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+
+from config.settings import load_config
+
+logger = logging.getLogger(__name__)
+
+_cache = None
+_cache_lock = Lock()
+
+# Hits are recorded in memory and written in batches of this many keys.
+ACCESS_FLUSH_SIZE = 100
+# Eviction trims the cache to this fraction of max_entries, so it runs once per many inserts.
+EVICTION_TARGET = 0.9
+
+def load_cache_config() -> dict:
+    """Load completion cache settings, falling back to defaults for missing keys."""
+    config = load_config()
+    return {
+        'enabled': config.getboolean('OPENAI', 'cache_enabled', fallback=True),
+        'path': config.get('OPENAI', 'cache_path', fallback='cache/completions.sqlite3'),
+        'ttl_seconds': config.getint('OPENAI', 'cache_ttl_seconds', fallback=30 * 24 * 3600),
+        'max_entries': config.getint('OPENAI', 'cache_max_entries', fallback=50000),
+    }
+
+def make_cache_key(prompt_name: str, prompt_text: str, user_prompt: str, model: str, temperature: float,
+                   response_format: dict = None, n: int = 1) -> str:
+    """Hash everything that determines a completion. Editing a prompt's text changes the key, so stale
+    completions of the old prompt are never returned."""
+    prompt_version = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
+    key_parts = [prompt_name, prompt_version, user_prompt, model, temperature]
+    if response_format is not None:
+        key_parts.append(response_format)
+    if n > 1:
+        key_parts.append({'n': n})
+    payload = json.dumps(key_parts, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class CompletionCache:
+    """SQLite store of chat completions with a time-to-live and least-recently-used eviction.
+    Access times of hits are kept in memory and written in batches, and eviction only runs once the
+    entry count goes over max_entries."""
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, prompt TEXT, model TEXT, response TEXT, created_at REAL, accessed_at REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+        self._connection.commit()
+        self._entries = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        self._accessed = {}
+
+    def get(self, key: str):
+        """Return the cached completion for a key, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT response, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    self._connection.commit()
+                    self._entries -= 1
+                    self._accessed.pop(key, None)
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= ACCESS_FLUSH_SIZE:
+                self._flush_accessed()
+            self.hits += 1
+            return row[0]
+
+    def _flush_accessed(self):
+        """Write the access times recorded since the last flush. Callers hold the lock."""
+        if not self._accessed:
+            return
+        self._connection.executemany(
+            "UPDATE completions SET accessed_at = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self._accessed.items()]
+        )
+        self._connection.commit()
+        self._accessed = {}
+
+    def set(self, key: str, prompt: str, model: str, response: str):
+        """Store a completion. Once the cache holds more than max_entries, the least recently used
+        entries are evicted down to EVICTION_TARGET of it."""
+        now = time.time()
+        with self._lock:
+            exists = self._connection.execute("SELECT 1 FROM completions WHERE key = ?", (key,)).fetchone() is not None
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, prompt, model, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, prompt, model, response, now, now)
+            )
+            self._accessed.pop(key, None)
+            if not exists:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self._flush_accessed()
+                evicted = self._entries - int(self.max_entries * EVICTION_TARGET)
+                self._connection.execute(
+                    "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY accessed_at LIMIT ?)",
+                    (evicted,)
+                )
+                self._entries -= evicted
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': self._entries}
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._connection.close()
+
+def get_completion_cache():
+    """Return the process-wide completion cache, or None when caching is disabled."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            config = load_cache_config()
+            if not config['enabled']:
+                return None
+            _cache = CompletionCache(config['path'], config['ttl_seconds'], config['max_entries'])
+        return _cache
+
+def close_completion_cache():
+    """Log the hit rate of this run and close the completion cache."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is not None:
+            stats = _cache.stats()
+            logger.info(f"Completion cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries.")
+            _cache.close()
+        _cache = None
+
+atexit.register(close_completion_cache)
@@ -0,0 +1,169 @@
+import atexit
+import hashlib
+import json
+import logging
+import math
+import os
+from datetime import datetime
+from threading import Lock
+
+from config.settings import load_config
+
+logger = logging.getLogger(__name__)
+
+RUN_ID = datetime.now().strftime('%Y%m%d%H%M%S')
+HISTOGRAM_WIDTH = 40
+
+_records = []
+_metrics_file = None
+_metrics_lock = Lock()
+
+def load_metrics_config() -> dict:
+    """Load completion metrics settings, falling back to defaults for missing keys."""
+    config = load_config()
+    return {
+        'enabled': config.getboolean('OPENAI', 'metrics_enabled', fallback=True),
+        'file': config.get('OPENAI', 'metrics_file', fallback='log/openai_calls.jsonl'),
+        'histograms': config.getboolean('OPENAI', 'metrics_histograms', fallback=False),
+    }
+
+def load_model_prices() -> dict:
+    """Map each model to its (input, output) price in dollars per million tokens."""
+    config = load_config()
+    if not config.has_section('OPENAI_PRICING'):
+        return {}
+    prices = {}
+    for model, value in config.items('OPENAI_PRICING'):
+        input_price, output_price = (float(price) for price in value.split(','))
+        prices[model] = (input_price, output_price)
+    return prices
+
+def prompt_version(prompt_text: str) -> str:
+    """Short hash of a prompt's text, so runs before and after a prompt edit can be told apart."""
+    return hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()[:12]
+
+def record_completion(prompt: str, prompt_text: str, model: str, latency: float, usage=None, retries=0,
+                      cache_hit=False, n=1, error: str = None, queued: float = 0.0):
+    """Record one chat completion call and append it to the metrics file of this run.
+    latency is the time of the request that produced the answer; queued is the time spent waiting
+    for the rate limiter and in backoff before it."""
+    global _metrics_file
+
+    config = load_metrics_config()
+    if not config['enabled']:
+        return
+    record = {
+        'run_id': RUN_ID,
+        'time': datetime.now().isoformat(),
+        'prompt': prompt,
+        'prompt_version': prompt_version(prompt_text),
+        'model': model,
+        'latency': round(latency, 4),
+        'queue_seconds': round(queued, 4),
+        'prompt_tokens': usage.prompt_tokens if usage else 0,
+        'completion_tokens': usage.completion_tokens if usage else 0,
+        'retries': retries,
+        'cache_hit': cache_hit,
+        'n': n,
+        'error': error,
+    }
+    with _metrics_lock:
+        _records.append(record)
+        try:
+            if _metrics_file is None:
+                directory = os.path.dirname(config['file'])
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                _metrics_file = open(config['file'], 'a')
+            _metrics_file.write(json.dumps(record) + '\n')
+            _metrics_file.flush()
+        except OSError as e:
+            logger.warning(f"Could not write completion metrics: {e}")
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)] if ordered else 0.0
+
+def summarize(records: list) -> list:
+    """Aggregate call records per prompt and model. Latency percentiles only cover calls that reached the API."""
+    prices = load_model_prices()
+    groups = {}
+    for record in records:
+        groups.setdefault((record['prompt'], record['model']), []).append(record)
+
+    rows = []
+    for (prompt, model), group in groups.items():
+        api_latencies = [record['latency'] for record in group if not record['cache_hit']]
+        prompt_tokens = sum(record['prompt_tokens'] for record in group)
+        completion_tokens = sum(record['completion_tokens'] for record in group)
+        input_price, output_price = prices.get(model, (0.0, 0.0))
+        rows.append({
+            'prompt': prompt,
+            'model': model,
+            'calls': len(group),
+            'cache_hits': sum(record['cache_hit'] for record in group),
+            'errors': sum(record['error'] is not None for record in group),
+            'retries': sum(record['retries'] for record in group),
+            'total_seconds': sum(record['latency'] for record in group),
+            'queue_seconds': sum(record['queue_seconds'] for record in group),
+            'p50_seconds': percentile(api_latencies, 0.5),
+            'p95_seconds': percentile(api_latencies, 0.95),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost': (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000,
+            'latencies': api_latencies,
+        })
+    return sorted(rows, key=lambda row: row['total_seconds'], reverse=True)
+
+def format_summary(rows: list) -> str:
+    """Render summary rows as a text table, slowest prompts first."""
+    header = f"{'prompt':<24} {'model':<14} {'calls':>6} {'cached':>6} {'errors':>6} {'retries':>7} {'total s':>9} {'queue s':>9} {'p50 s':>7} {'p95 s':>7} {'in tok':>9} {'out tok':>9} {'cost $':>9}"
+    lines = [header, '-' * len(header)]
+    for row in rows:
+        lines.append(
+            f"{row['prompt']:<24} {row['model']:<14} {row['calls']:>6} {row['cache_hits']:>6} {row['errors']:>6} {row['retries']:>7} "
+            f"{row['total_seconds']:>9.2f} {row['queue_seconds']:>9.2f} {row['p50_seconds']:>7.2f} {row['p95_seconds']:>7.2f} "
+            f"{row['prompt_tokens']:>9} {row['completion_tokens']:>9} {row['cost']:>9.4f}"
+        )
+    lines.append('-' * len(header))
+    lines.append(
+        f"{'total':<24} {'':<14} {sum(row['calls'] for row in rows):>6} {sum(row['cache_hits'] for row in rows):>6} "
+        f"{sum(row['errors'] for row in rows):>6} {sum(row['retries'] for row in rows):>7} {sum(row['total_seconds'] for row in rows):>9.2f} "
+        f"{sum(row['queue_seconds'] for row in rows):>9.2f} {'':>7} {'':>7} {sum(row['prompt_tokens'] for row in rows):>9} {sum(row['completion_tokens'] for row in rows):>9} "
+        f"{sum(row['cost'] for row in rows):>9.4f}"
+    )
+    return '\n'.join(lines)
+
+def format_histogram(prompt: str, latencies: list) -> str:
+    """Render API latencies in power-of-two buckets from 0.25s upwards."""
+    buckets = {}
+    for latency in latencies:
+        bucket = max(-2, math.ceil(math.log2(latency))) if latency > 0 else -2
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    largest = max(buckets.values())
+    lines = [f"{prompt} latency:"]
+    for bucket in range(min(buckets), max(buckets) + 1):
+        count = buckets.get(bucket, 0)
+        lines.append(f"  <= {2.0 ** bucket:>7.2f}s {count:>6} {'#' * math.ceil(count * HISTOGRAM_WIDTH / largest)}")
+    return '\n'.join(lines)
+
+def close_metrics():
+    """Log the per-prompt summary of this run and close the metrics file."""
+    global _metrics_file
+
+    with _metrics_lock:
+        records = list(_records)
+        if _metrics_file is not None:
+            _metrics_file.close()
+        _metrics_file = None
+    if not records:
+        return
+
+    rows = summarize(records)
+    logger.info(f"OpenAI calls this run ({RUN_ID}):\n{format_summary(rows)}")
+    if load_metrics_config()['histograms']:
+        histograms = [format_histogram(row['prompt'], row['latencies']) for row in rows if row['latencies']]
+        if histograms:
+            logger.info('\n'.join(histograms))
+
+atexit.register(close_metrics)
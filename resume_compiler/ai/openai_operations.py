@@ -1,54 +1,450 @@
+import asyncio
+import atexit
+import json
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from openai import OpenAI
+from collections import Counter
+from functools import lru_cache
+from threading import Lock
+from time import perf_counter
+from openai import (
+    DEFAULT_CONNECTION_LIMITS, APIConnectionError, APITimeoutError, AsyncOpenAI, DefaultAsyncHttpxClient,
+    DefaultHttpxClient, InternalServerError, OpenAI, RateLimitError, Timeout
+)
 from dotenv import load_dotenv
-from ai.ai_helper_functions import load_prompts
+from ai.ai_helper_functions import count_tokens, dedupe_candidates, estimate_tokens, fit_prompt, load_prompts
+from ai.completion_cache import get_completion_cache, make_cache_key
+from ai.metrics import record_completion
+from ai.rate_limiter import RateLimiter, backoff_delay, parse_reset_duration
+from config.settings import load_config
 
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-
 prompts = load_prompts()
 
-if not openai_api_key:
-    raise ValueError("OpenAI API key is not set in the environment variables")
+_client = None
+_client_pid = None
+_async_client = None
+_async_client_loop = None
+_client_lock = Lock()
+_analysis_loop = None
+_analysis_limiter = None
+
+SKILLS_COUNT = 15
+wasted_completions = Counter()
+_wasted_lock = Lock()
+
+def load_openai_client_config() -> dict:
+    """Load OpenAI HTTP connection settings, falling back to defaults for missing keys."""
+    config = load_config()
+    return {
+        'max_connections': config.getint('OPENAI', 'max_connections', fallback=20),
+        'max_keepalive_connections': config.getint('OPENAI', 'max_keepalive_connections', fallback=10),
+        'keepalive_expiry': config.getfloat('OPENAI', 'keepalive_expiry_seconds', fallback=30),
+        'timeout': config.getfloat('OPENAI', 'timeout_seconds', fallback=60),
+        'connect_timeout': config.getfloat('OPENAI', 'connect_timeout_seconds', fallback=10),
+        'max_retries': config.getint('OPENAI', 'max_retries', fallback=2),
+        # Point the client at a compatible stand-in server, e.g. for testing; empty uses OPENAI_BASE_URL or the API.
+        'base_url': config.get('OPENAI', 'base_url', fallback='') or None,
+    }
+
+@lru_cache(maxsize=None)
+def get_openai_api_key() -> str:
+    """Read the API key from the environment or .env when the first client is created, so importing
+    this module neither needs a key nor raises without one."""
+    load_dotenv()
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        raise ValueError("OpenAI API key is not set in the environment variables")
+    return openai_api_key
+
+def load_rate_limit_config() -> dict:
+    """Load the request pacing settings of the async path, falling back to defaults for missing keys."""
+    config = load_config()
+    return {
+        'requests_per_minute': config.getfloat('OPENAI', 'requests_per_minute', fallback=500),
+        'tokens_per_minute': config.getfloat('OPENAI', 'tokens_per_minute', fallback=200000),
+        'max_concurrency': config.getint('OPENAI', 'max_concurrency', fallback=16),
+        'max_attempts': config.getint('OPENAI', 'max_attempts', fallback=8),
+        'backoff_base': config.getfloat('OPENAI', 'backoff_base_seconds', fallback=1),
+        'backoff_max': config.getfloat('OPENAI', 'backoff_max_seconds', fallback=60),
+        'completion_tokens': config.getint('OPENAI', 'completion_token_estimate', fallback=300),
+    }
+
+def build_http_client_options(config: dict) -> dict:
+    """Return the pooling and timeout options shared by the sync and async HTTP clients."""
+    # Build Limits from the HTTP library the installed SDK is built on rather than importing it directly.
+    limits_class = type(DEFAULT_CONNECTION_LIMITS)
+    return {
+        'limits': limits_class(
+            max_connections=config['max_connections'],
+            max_keepalive_connections=config['max_keepalive_connections'],
+            keepalive_expiry=config['keepalive_expiry'],
+        ),
+        'timeout': Timeout(config['timeout'], connect=config['connect_timeout']),
+    }
+
+def get_openai_client() -> OpenAI:
+    """Return the process-wide OpenAI client, creating it on first use or after a fork.
+    Reusing it keeps connections alive between calls instead of opening a new pool per request."""
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            config = load_openai_client_config()
+            _client = OpenAI(
+                api_key=get_openai_api_key(),
+                base_url=config['base_url'],
+                max_retries=config['max_retries'],
+                http_client=DefaultHttpxClient(**build_http_client_options(config)),
+            )
+            _client_pid = pid
+        return _client
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """Return the AsyncOpenAI client of the running event loop.
+    Async connections are bound to the loop that opened them, so a new loop gets a new client."""
+    global _async_client, _async_client_loop
+
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        if _async_client is None or _async_client_loop is not loop:
+            config = load_openai_client_config()
+            _async_client = AsyncOpenAI(
+                api_key=get_openai_api_key(),
+                base_url=config['base_url'],
+                max_retries=config['max_retries'],
+                http_client=DefaultAsyncHttpxClient(**build_http_client_options(config)),
+            )
+            _async_client_loop = loop
+        return _async_client
+
+async def close_async_openai_client():
+    """Close the AsyncOpenAI client of the running event loop, before the loop itself is closed."""
+    global _async_client, _async_client_loop
+
+    with _client_lock:
+        client = _async_client if _async_client_loop is asyncio.get_running_loop() else None
+        _async_client = None
+        _async_client_loop = None
+    if client is not None:
+        await client.close()
+
+def close_openai_client():
+    """Close the process-wide OpenAI client if this process opened it."""
+    global _client, _client_pid
+
+    if wasted_completions:
+        logger.info(f"Discarded completions by prompt: {dict(wasted_completions)}")
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+def json_schema_format(name: str, schema: dict) -> dict:
+    """Response format that makes the model answer with JSON matching schema."""
+    return {'type': 'json_schema', 'json_schema': {'name': name, 'strict': True, 'schema': schema}}
+
+def string_list_format(name: str, length: int) -> dict:
+    """Response format of an object holding exactly length strings under name."""
+    return json_schema_format(name, {
+        'type': 'object',
+        'properties': {name: {'type': 'array', 'items': {'type': 'string'}, 'minItems': length, 'maxItems': length}},
+        'required': [name],
+        'additionalProperties': False,
+    })
+
+SKILLS_RESPONSE_FORMAT = string_list_format('skills', SKILLS_COUNT)
+
+def get_profiles() -> list:
+    """Return the resume profiles that have a template configured."""
+    return [key[:-len('_template')] for key in load_config()['RESUME'] if key.endswith('_template')]
+
+def profile_format() -> dict:
+    return json_schema_format('profile', {
+        'type': 'object',
+        'properties': {'profile': {'type': 'string', 'enum': get_profiles()}},
+        'required': ['profile'],
+        'additionalProperties': False,
+    })
+
+def record_wasted_completion(prompt_name: str, reason: str):
+    """Count a completion that had to be thrown away."""
+    with _wasted_lock:
+        wasted_completions[prompt_name] += 1
+    logger.warning(f"Discarded {prompt_name} completion: {reason}")
+
+def parse_json_field(prompt_name: str, content: str, field: str):
+    """Return field of a structured response, or None if the response cannot be parsed."""
+    try:
+        return json.loads(content)[field]
+    except (TypeError, ValueError, KeyError) as e:
+        record_wasted_completion(prompt_name, f"unparseable response ({e})")
+        return None
+
+def parse_string_list(prompt_name: str, content: str, field: str, length: int):
+    """Return the non-empty strings of a structured list response, or None unless there are exactly length."""
+    values = parse_json_field(prompt_name, content, field)
+    if values is None:
+        return None
+    values = [value.strip() for value in values if isinstance(value, str) and value.strip()]
+    if len(values) != length:
+        record_wasted_completion(prompt_name, f"expected {length} items, got {len(values)}")
+        return None
+    return values
+
+def response_format_options(response_format: dict) -> dict:
+    return {'response_format': response_format} if response_format is not None else {}
+
+def get_input_token_budget(prompt_name: str) -> int:
+    """Return the maximum number of user input tokens sent with a prompt."""
+    config = load_config()
+    return config.getint('TOKEN_BUDGETS', prompt_name, fallback=config.getint('TOKEN_BUDGETS', 'default', fallback=8000))
 
-def create_chat_completion(system_prompt: str, user_prompt: str, model='gpt-4o-mini', temperature=0.5) -> str:
-    """Create a chat completion using OpenAI."""
-    client = OpenAI(api_key=openai_api_key)
+@lru_cache(maxsize=None)
+def get_system_prompt_tokens(prompt_name: str, model: str) -> int:
+    return count_tokens(prompts[prompt_name], model)
+
+def fit_user_prompt(system_prompt: str, user_prompt: str, model: str) -> tuple:
+    """Truncate the user input of a prompt to its token budget. Returns the input and its token count,
+    or None for the count when the input was short enough not to be tokenized."""
+    budget = get_input_token_budget(system_prompt)
+    fitted_prompt, tokens = fit_prompt(user_prompt, budget, model)
+    if len(fitted_prompt) < len(user_prompt):
+        logger.warning(f"Truncated {system_prompt} input from {len(user_prompt)} to {len(fitted_prompt)} characters to fit {budget} tokens.")
+    return fitted_prompt, tokens
+
+def create_chat_completion(system_prompt: str, user_prompt: str, model='gpt-4o-mini', temperature=0.5, use_cache=True,
+                           response_format: dict = None, n=1):
+    """Create a chat completion using OpenAI, answering repeated requests from the completion cache.
+    use_cache=False always calls the API, e.g. to retry a rejected answer, and stores the new completion.
+    A response_format built with json_schema_format constrains the answer to JSON matching the schema.
+    With n > 1, n choices are sampled in one request and a list of the distinct ones is returned.
+    Every call, cached or not, is recorded in the completion metrics of the run."""
+    start = perf_counter()
+    user_prompt, _ = fit_user_prompt(system_prompt, user_prompt, model)
+    cache = get_completion_cache()
+    cache_key = make_cache_key(system_prompt, prompts[system_prompt], user_prompt, model, temperature, response_format, n)
+    if cache is not None and use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            record_completion(system_prompt, prompts[system_prompt], model, perf_counter() - start, cache_hit=True, n=n)
+            return json.loads(cached) if n > 1 else cached
+
+    client = get_openai_client()
     messages = [
         {"role": "system", "content": prompts[system_prompt]},
         {"role": "user", "content": user_prompt}
     ]
 
+    request_start = perf_counter()
     try:
-        response = client.chat.completions.create(model=model, messages=messages, temperature=temperature)
-        return response.choices[0].message.content
+        raw_response = client.chat.completions.with_raw_response.create(
+            model=model, messages=messages, temperature=temperature, **response_format_options(response_format),
+            **({'n': n} if n > 1 else {})
+        )
+        response = raw_response.parse()
+        record_completion(system_prompt, prompts[system_prompt], model, perf_counter() - request_start, response.usage,
+                          retries=raw_response.retries_taken, n=n)
+        if n > 1:
+            candidates = dedupe_candidates([choice.message.content for choice in response.choices])
+            logger.debug(f"{system_prompt}: {len(candidates)} distinct of {len(response.choices)} choices")
+            content = json.dumps(candidates)
+        else:
+            content = response.choices[0].message.content
     except Exception as e:
+        record_completion(system_prompt, prompts[system_prompt], model, perf_counter() - request_start, n=n, error=e.__class__.__name__)
         logger.error("Error creating chat completion:", exc_info=True)
         raise
 
-def analyze_description(description: str, prompt: str) -> str:
-    """Analyze a job description using a given prompt."""
-    return create_chat_completion(prompt, description, temperature=0.4)
+    if cache is not None and content is not None:
+        cache.set(cache_key, system_prompt, model, content)
+    return json.loads(content) if n > 1 else content
+
+def is_quota_exhausted(error: RateLimitError) -> bool:
+    """A 429 for an exhausted quota will not succeed on retry, unlike a per-minute rate limit."""
+    body = error.body if isinstance(error.body, dict) else {}
+    return body.get('code') == 'insufficient_quota' or (body.get('error') or {}).get('code') == 'insufficient_quota'
+
+def get_retry_after(headers) -> float:
+    """Return how long the server asked us to wait, in seconds."""
+    if headers.get('retry-after-ms'):
+        return float(headers['retry-after-ms']) / 1000
+    if headers.get('retry-after'):
+        try:
+            return float(headers['retry-after'])
+        except ValueError:
+            pass
+    return max(parse_reset_duration(headers.get('x-ratelimit-reset-requests')),
+               parse_reset_duration(headers.get('x-ratelimit-reset-tokens')))
+
+async def create_chat_completion_async(limiter: RateLimiter, system_prompt: str, user_prompt: str,
+                                       model='gpt-4o-mini', temperature=0.5, use_cache=True, response_format: dict = None) -> str:
+    """Create a chat completion on the async client, paced by the limiter and retried with jittered backoff
+    on rate limits, timeouts, connection errors and server errors."""
+    start = perf_counter()
+    user_prompt, user_tokens = fit_user_prompt(system_prompt, user_prompt, model)
+    cache = get_completion_cache()
+    cache_key = make_cache_key(system_prompt, prompts[system_prompt], user_prompt, model, temperature, response_format)
+    if cache is not None and use_cache:
+        # SQLite calls block, so they run in a worker thread rather than on the event loop.
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            record_completion(system_prompt, prompts[system_prompt], model, perf_counter() - start, cache_hit=True)
+            return cached
+
+    config = load_rate_limit_config()
+    # Retries are handled here so the limiter sees every 429.
+    client = get_async_openai_client().with_options(max_retries=0)
+    messages = [
+        {"role": "system", "content": prompts[system_prompt]},
+        {"role": "user", "content": user_prompt}
+    ]
+    estimated_tokens = (
+        get_system_prompt_tokens(system_prompt, model)
+        + (user_tokens if user_tokens is not None else estimate_tokens(user_prompt))
+        + config['completion_tokens']
+    )
+
+    # Latency covers only the request itself; waits for the limiter and backoff sleeps are queue time.
+    queued = 0.0
+    for attempt in range(config['max_attempts']):
+        delay = 0
+        wait_start = perf_counter()
+        await limiter.acquire(estimated_tokens)
+        request_start = perf_counter()
+        queued += request_start - wait_start
+        try:
+            raw_response = await client.chat.completions.with_raw_response.create(
+                model=model, messages=messages, temperature=temperature, **response_format_options(response_format)
+            )
+            limiter.on_success(raw_response.headers)
+            response = raw_response.parse()
+            content = response.choices[0].message.content
+            record_completion(system_prompt, prompts[system_prompt], model, perf_counter() - request_start, response.usage, retries=attempt, queued=queued)
+            break
+        except RateLimitError as e:
+            if is_quota_exhausted(e):
+                record_completion(system_prompt, prompts[system_prompt], model, perf_counter() - request_start, retries=attempt,
+                                  queued=queued, error=e.__class__.__name__)
+                logger.error("OpenAI quota exhausted.")
+                raise
+            limiter.on_rate_limited(get_retry_after(e.response.headers) or backoff_delay(attempt, config['backoff_base'], config['backoff_max']))
+            if attempt == config['max_attempts'] - 1:
+                record_completion(system_prompt, prompts[system_prompt], model, perf_counter() - request_start, retries=attempt,
+                                  queued=queued, error=e.__class__.__name__)
+                raise
+        except (APIConnectionError, APITimeoutError, InternalServerError) as e:
+            if attempt == config['max_attempts'] - 1:
+                record_completion(system_prompt, prompts[system_prompt], model, perf_counter() - request_start, retries=attempt,
+                                  queued=queued, error=e.__class__.__name__)
+                raise
+            delay = backoff_delay(attempt, config['backoff_base'], config['backoff_max'])
+            logger.warning(f"Chat completion failed ({e.__class__.__name__}), retrying in {delay:.1f}s.")
+        finally:
+            await limiter.release()
+        await asyncio.sleep(delay)
+        queued += delay
+
+    if cache is not None and content is not None:
+        await asyncio.to_thread(cache.set, cache_key, system_prompt, model, content)
+    return content
 
-def pick_a_hat(role: str) -> str:
-    """Choose the closest profile using a given prompt."""
-    return create_chat_completion('pick_a_hat', role, temperature=0.4)
+def pick_a_hat(role: str, use_cache=True):
+    """Choose the closest configured profile for a role, or None if the response is unusable."""
+    response = create_chat_completion('pick_a_hat', role, temperature=0.4, use_cache=use_cache, response_format=profile_format())
+    return parse_json_field('pick_a_hat', response, 'profile')
+
+def capitalize_skills(skills: list, use_cache=True):
+    """Return the skills capitalized, or None if the response does not hold exactly as many skills."""
+    response = create_chat_completion(
+        "capitalize_skills", "^_^".join(skills), temperature=0.4, use_cache=use_cache,
+        response_format=string_list_format('skills', len(skills))
+    )
+    return parse_string_list("capitalize_skills", response, 'skills', len(skills))
+
+def generate_achievement_bullets(skill: str, count: int, use_cache=True):
+    """Generate count achievement bullets for a skill, or None if the response is unusable."""
+    response = create_chat_completion(
+        "build_achievements", skill, temperature=0.8, use_cache=use_cache,
+        response_format=string_list_format('bullets', count)
+    )
+    return parse_string_list("build_achievements", response, 'bullets', count)
+
+def get_analysis_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop skills analysis runs on. It is kept across calls, so the rate limiter, with the
+    limits learned from response headers, and the pooled async client carry over from one batch to the next."""
+    global _analysis_loop, _analysis_limiter
+
+    if _analysis_loop is None or _analysis_loop.is_closed():
+        _analysis_loop = asyncio.new_event_loop()
+        _analysis_limiter = None
+    return _analysis_loop
+
+def get_analysis_limiter() -> RateLimiter:
+    """Return the rate limiter of the analysis loop, creating it on that loop on first use."""
+    global _analysis_limiter
+
+    if _analysis_limiter is None:
+        config = load_rate_limit_config()
+        _analysis_limiter = RateLimiter(config['requests_per_minute'], config['tokens_per_minute'], config['max_concurrency'])
+    return _analysis_limiter
+
+def close_skills_analysis():
+    """Close the async client and the event loop skills analysis ran on."""
+    global _analysis_loop, _analysis_limiter
+
+    if _analysis_loop is not None and not _analysis_loop.is_closed():
+        _analysis_loop.run_until_complete(close_async_openai_client())
+        _analysis_loop.run_until_complete(_analysis_loop.shutdown_default_executor())
+        _analysis_loop.close()
+    _analysis_loop = None
+    _analysis_limiter = None
+
+async def skills_analysis_async(job_descriptions: dict, use_cache=True) -> tuple:
+    """Analyze job descriptions concurrently within the account's rate limits.
+
+    Returns the parsed skills keyed by job id, None for answers without exactly 15 skills, and the job
+    ids whose request failed after all retries, which another attempt would not fix. An exhausted quota aborts."""
+    limiter = get_analysis_limiter()
+
+    async def analyze(key, description):
+        try:
+            response = await create_chat_completion_async(
+                limiter, "skills_analysis", description, temperature=0.4, use_cache=use_cache, response_format=SKILLS_RESPONSE_FORMAT
+            )
+        except RateLimitError:
+            raise
+        except Exception:
+            logger.error(f"Skills analysis failed for job id {key}.", exc_info=True)
+            return key, None, True
+        return key, parse_string_list("skills_analysis", response, 'skills', SKILLS_COUNT), False
 
-def skills_analysis(job_descriptions: dict) -> list:
-    """Analyze job descriptions using a given prompt in parallel."""
     job_skills = {}
-    with ThreadPoolExecutor() as executor:
-        future_to_key = {executor.submit(analyze_description, desc, "skills_analysis"): key for key, desc in job_descriptions.items()}
-        for future in as_completed(future_to_key):
-            try:
-                result = future.result()
-                key = future_to_key[future]
+    failed_job_ids = []
+    tasks = [asyncio.create_task(analyze(key, desc)) for key, desc in job_descriptions.items()]
+    try:
+        for task in asyncio.as_completed(tasks):
+            key, result, failed = await task
+            if failed:
+                failed_job_ids.append(key)
+            else:
                 job_skills[key] = result
-            except Exception as e:
-                logger.error("Job analysis failed.", exc_info=True)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # The loop outlives this call, so let cancelled requests finish unwinding before returning.
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return job_skills, failed_job_ids
+
+def skills_analysis(job_descriptions: dict, use_cache=True) -> tuple:
+    """Analyze job descriptions in parallel on the shared analysis loop. See skills_analysis_async.
+    Call close_skills_analysis once the run is done."""
+    return get_analysis_loop().run_until_complete(skills_analysis_async(job_descriptions, use_cache))
 
-        return job_skills
\ No newline at end of file
+atexit.register(close_openai_client)
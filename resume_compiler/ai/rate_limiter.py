@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_reset_duration(value: str) -> float:
+    """Parse an x-ratelimit-reset-* header such as '1s', '6m0s' or '20ms' into seconds."""
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in DURATION_PATTERN.findall(value or ''))
+
+def backoff_delay(attempt: int, base: float, maximum: float) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+class TokenBucket:
+    """Refills continuously at a per-minute rate up to one minute's worth of capacity."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        """Wait until amount is available and take it. Requests larger than the capacity take the whole bucket."""
+        amount = min(amount, self.per_minute)
+        async with self._lock:
+            self._refill()
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) * 60 / self.per_minute)
+                self._refill()
+            self.level -= amount
+
+    def sync(self, limit: float, remaining: float):
+        """Adopt the limit and remaining budget the server reported."""
+        self._refill()
+        self.per_minute = limit
+        self.level = min(self.level, remaining)
+
+class AdaptiveConcurrency:
+    """Caps in-flight requests. The cap halves on a rate limit and grows back by one per cap's worth of successes."""
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self._credit = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def decrease(self):
+        self.limit = max(1, self.limit // 2)
+        self._credit = 0.0
+
+    def increase(self):
+        if self.limit >= self.max_concurrency:
+            return
+        self._credit += 1 / self.limit
+        if self._credit >= 1:
+            self.limit += 1
+            self._credit = 0.0
+
+class RateLimiter:
+    """Keeps requests within requests-per-minute, tokens-per-minute and an adaptive concurrency cap.
+    Must be created inside the event loop that uses it."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_concurrency: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self._resume_at = 0.0
+
+    async def acquire(self, tokens: int):
+        await self.concurrency.acquire()
+        pause = self._resume_at - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+    async def release(self):
+        await self.concurrency.release()
+
+    def on_success(self, headers):
+        self.concurrency.increase()
+        self.update_from_headers(headers)
+
+    def on_rate_limited(self, retry_after: float):
+        """Shrink concurrency and hold back every request until the server's retry delay has passed."""
+        self.concurrency.decrease()
+        self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+        logger.warning(f"Rate limited; concurrency reduced to {self.concurrency.limit}, pausing {retry_after:.1f}s.")
+
+    def update_from_headers(self, headers):
+        """Follow the x-ratelimit-* headers so the buckets track the account's actual limits."""
+        for bucket, kind in ((self.requests, 'requests'), (self.tokens, 'tokens')):
+            limit = headers.get(f'x-ratelimit-limit-{kind}')
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            if limit and remaining:
+                bucket.sync(float(limit), float(remaining))
@@ -1,8 +1,10 @@
 from configparser import ConfigParser
+from functools import lru_cache
 
 
+@lru_cache(maxsize=None)
 def load_config():
-    """Load configuration from config.ini."""
+    """Load configuration from config.ini, reading the file once per process."""
     config = ConfigParser()
     config.read('config.ini')
-    return config
\ No newline at end of file
+    return config
@@ -0,0 +1,177 @@
+import gzip
+import hashlib
+import io
+import logging
+import mmap
+import os
+import struct
+from bson import json_util
+from bson.raw_bson import RawBSONDocument
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+WRITE_CHUNK_SIZE = 1 << 20
+
+BACKUP_FORMATS = ('json', 'bson')
+
+COMPRESSION_EXTENSIONS = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+class HashingWriter(io.RawIOBase):
+    """Binary file wrapper that tracks the size and SHA-256 of everything written through it."""
+
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.file.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self.file.close()
+
+def resolve_compression(compression: str) -> str:
+    """Return a usable compression name, falling back to gzip when zstandard is not installed."""
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unsupported backup compression: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        logger.warning("zstandard is not installed; falling back to gzip backup compression.")
+        return 'gzip'
+    return compression
+
+def resolve_format(backup_format: str) -> str:
+    if backup_format not in BACKUP_FORMATS:
+        raise ValueError(f"Unsupported backup format: {backup_format}")
+    return backup_format
+
+def backup_file_name(collection_name: str, compression: str, backup_format: str = 'json') -> str:
+    return f"{collection_name}.{backup_format}{COMPRESSION_EXTENSIONS[compression]}"
+
+def backup_file_format(file_path: str) -> str:
+    """Return the format of a backup file from its name."""
+    name = os.path.basename(file_path)
+    for extension in COMPRESSION_EXTENSIONS.values():
+        if extension and name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+    return 'bson' if name.endswith('.bson') else 'json'
+
+def find_backup_file(backup_path: str, collection_name: str):
+    """Return the backup file of a collection in any supported format and compression, or None."""
+    for backup_format in BACKUP_FORMATS:
+        for compression in COMPRESSION_EXTENSIONS:
+            file_path = os.path.join(backup_path, backup_file_name(collection_name, compression, backup_format))
+            if os.path.exists(file_path):
+                return file_path
+    return None
+
+def open_compressed_writer(raw, compression: str, level: int):
+    """Wrap a binary file object in a compressing stream."""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=level).stream_writer(raw, closefd=False)
+    return raw
+
+def open_binary_reader(file_path: str):
+    """Open a backup file for reading bytes, decompressing according to its extension."""
+    if file_path.endswith(COMPRESSION_EXTENSIONS['gzip']):
+        return gzip.open(file_path, 'rb')
+    if file_path.endswith(COMPRESSION_EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {file_path}")
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+    return open(file_path, 'rb')
+
+def open_backup_reader(file_path: str):
+    """Open a backup file for reading text lines, decompressing according to its extension."""
+    if file_path.endswith(COMPRESSION_EXTENSIONS['gzip']):
+        return gzip.open(file_path, 'rt', encoding='utf-8')
+    if file_path.endswith(COMPRESSION_EXTENSIONS['zstd']):
+        return io.TextIOWrapper(open_binary_reader(file_path), encoding='utf-8')
+    return open(file_path, 'r', encoding='utf-8')
+
+def write_records(records, file_path: str, compression: str, level: int) -> dict:
+    """Stream encoded records into a (compressed) file in large chunks and return its count, size and checksum."""
+    count = 0
+    with HashingWriter(open(file_path, 'wb')) as raw:
+        writer = open_compressed_writer(raw, compression, level)
+        chunk, chunk_size = [], 0
+        for record in records:
+            chunk.append(record)
+            chunk_size += len(record)
+            count += 1
+            if chunk_size >= WRITE_CHUNK_SIZE:
+                writer.write(b''.join(chunk))
+                chunk, chunk_size = [], 0
+        writer.write(b''.join(chunk))
+        if writer is not raw:
+            writer.close()
+
+    return {
+        'file': os.path.basename(file_path),
+        'count': count,
+        'size': raw.size,
+        'sha256': raw.sha256.hexdigest(),
+    }
+
+def write_json_lines(documents, file_path: str, compression: str = 'none', level: int = 6) -> dict:
+    """Stream documents as Extended JSON lines into a (compressed) file and return its count, size and checksum."""
+    return write_records(
+        (json_util.dumps(document).encode('utf-8') + b'\n' for document in documents),
+        file_path, compression, level
+    )
+
+def write_raw_bson(documents, file_path: str, compression: str = 'none', level: int = 6) -> dict:
+    """Stream RawBSONDocuments into a (compressed) file of concatenated BSON documents, the layout mongodump uses.
+    The documents are written as received from the server and never decoded."""
+    return write_records((document.raw for document in documents), file_path, compression, level)
+
+def read_raw_bson(file_path: str):
+    """Yield the documents of a BSON backup file as RawBSONDocuments without decoding them.
+    Uncompressed files are memory-mapped and sliced on each document's length prefix."""
+    if backup_file_format(file_path) != 'bson':
+        raise ValueError(f"Not a BSON backup file: {file_path}")
+
+    if not file_path.endswith(tuple(ext for ext in COMPRESSION_EXTENSIONS.values() if ext)):
+        with open(file_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset, end = 0, len(data)
+                while offset < end:
+                    (length,) = struct.unpack_from('<i', data, offset)
+                    yield RawBSONDocument(data[offset:offset + length])
+                    offset += length
+        return
+
+    with open_binary_reader(file_path) as file:
+        while True:
+            prefix = file.read(4)
+            if not prefix:
+                return
+            (length,) = struct.unpack('<i', prefix)
+            body = file.read(length - 4)
+            if len(body) != length - 4:
+                raise ValueError(f"Truncated BSON document in {file_path}")
+            yield RawBSONDocument(prefix + body)
@@ -1,25 +1,41 @@
 import json
 import logging
 import os
-from bson import json_util
+from bson import ObjectId, json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from time import perf_counter
 from shutil import rmtree
-from pymongo import MongoClient
-from database.db_helper_functions import get_client, load_mongodb_config
+from pymongo import MongoClient, ReplaceOne
+from config.settings import load_config
+from database.backup_formats import (
+    backup_file_format, backup_file_name, find_backup_file, open_backup_reader, read_raw_bson,
+    resolve_compression, resolve_format, write_json_lines, write_raw_bson
+)
+from database.db_helper_functions import get_client, load_mongodb_config, utc_now
+from database.index_operations import ensure_indexes, verify_query_plans
+from database.migrations import PRE_INDEX_MIGRATIONS, reset_migrations, run_migrations
 
 logger = logging.getLogger(__name__)
 
-def generate_collections_map(backup_dir: str) -> dict:
-    """Generate map of required collections."""
-    try:
-        backup_path = get_most_recent_backup(backup_dir)
-        return {
-            "bullet_points": os.path.join(backup_path, 'bullet_points.json'),
-            "job_postings": os.path.join(backup_path, 'job_postings.json')
-        }
-    except FileNotFoundError as e:
-        logger.error(e)
-        return {}
+MANIFEST_FILE = 'manifest.json'
+CATALOG_FILE = 'catalog.json'
+BACKUP_FULL = 'full'
+BACKUP_DIFFERENTIAL = 'differential'
+
+def generate_collections_map(backup_path: str) -> dict:
+    """Generate map of required collections for a backup directory."""
+    collections_map = {
+        "bullet_points": find_backup_file(backup_path, 'bullet_points') or os.path.join(backup_path, 'bullet_points.json'),
+        "job_postings": find_backup_file(backup_path, 'job_postings') or os.path.join(backup_path, 'job_postings.json')
+    }
+    # Backups taken before bullets were normalized keep them embedded in bullet_points.
+    bullets_path = find_backup_file(backup_path, 'bullets')
+    if bullets_path:
+        collections_map["bullets"] = bullets_path
+    return collections_map
 
 def db_exists(client: MongoClient, db_name: str) -> bool:
     """Check if a database exists in the MongoDB instance."""
@@ -29,95 +45,351 @@ def collection_is_empty(db, collection_name: str) -> bool:
     """Check if a collection is empty or doesn't exist."""
     return not (collection_name in db.list_collection_names() and db[collection_name].count_documents({}) > 0)
 
-def get_most_recent_backup(backup_dir: str) -> str:
-    """Return the most recent backup based on the timestamp encoded in the directory name."""
+def parse_backup_timestamp(dir_name: str) -> datetime:
+    """Parse the timestamp encoded at the end of a backup directory name."""
+    return datetime.strptime('_'.join(dir_name.split('_')[-5:]), '%Y_%m_%d_%H_%M')
+
+def list_backups(backup_dir: str) -> list:
+    """Return backup directory names ordered from oldest to newest by the timestamp in their name."""
     dirs = [d for d in os.listdir(backup_dir) if os.path.isdir(os.path.join(backup_dir, d))]
-    if not dirs:
+    return sorted(dirs, key=parse_backup_timestamp)
+
+def read_manifest(backup_path: str) -> dict:
+    """Return the manifest of a backup, or an empty dict for backups written before manifests existed."""
+    manifest_path = os.path.join(backup_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as file:
+        return json.load(file)
+
+def rebuild_catalog(backup_dir: str) -> list:
+    """Build catalog entries from the backup directories and their manifests."""
+    entries = []
+    for name in list_backups(backup_dir):
+        manifest = read_manifest(os.path.join(backup_dir, name))
+        entry = {'created': parse_backup_timestamp(name).isoformat(), 'type': BACKUP_FULL, **manifest, 'name': name}
+        entries.append(entry)
+    logger.info(f"Rebuilt the backup catalog from {len(entries)} backup directories.")
+    return entries
+
+def save_catalog(backup_dir: str, entries: list):
+    """Atomically replace the backup catalog."""
+    catalog_path = os.path.join(backup_dir, CATALOG_FILE)
+    temp_path = f"{catalog_path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump({'backups': entries}, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, catalog_path)
+
+def load_catalog(backup_dir: str) -> list:
+    """Return the catalog entries of the backups in backup_dir, oldest first.
+    The catalog is rebuilt from the backup directories when it is missing or unreadable."""
+    try:
+        with open(os.path.join(backup_dir, CATALOG_FILE)) as file:
+            return json.load(file)['backups']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        if not os.path.isdir(backup_dir):
+            return []
+        entries = rebuild_catalog(backup_dir)
+        save_catalog(backup_dir, entries)
+        return entries
+
+def get_restore_chain(backup_dir: str) -> list:
+    """Return the backup paths to restore in order: a full snapshot, followed by the newest differential if any."""
+    entries = load_catalog(backup_dir)
+    if not entries:
         raise FileNotFoundError(f"No backup directories found in {backup_dir}")
 
-    sorted_dirs = sorted(dirs, key=lambda x: datetime.strptime('_'.join(x.split('_')[-5:]), '%Y_%m_%d_%H_%M'))
-    return os.path.join(backup_dir, sorted_dirs[-1])
+    latest = entries[-1]
+    backup_path = os.path.join(backup_dir, latest['name'])
+    if latest['type'] == BACKUP_DIFFERENTIAL:
+        return [os.path.join(backup_dir, latest['base']), backup_path]
+    return [backup_path]
+
+def read_backup_documents(file_path: str):
+    """Yield the documents stored in a backup file. BSON backups yield undecoded RawBSONDocuments."""
+    if backup_file_format(file_path) == 'bson':
+        yield from read_raw_bson(file_path)
+        return
+    with open_backup_reader(file_path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            data = json_util.loads(line)
+            if isinstance(data, list):
+                yield from data
+            else:
+                yield data
+
+def load_documents_in_batches(collection_name: str, file_path: str, batch_size: int, write_batch) -> int:
+    """Pass the documents of a backup file to write_batch in lists of batch_size, logging progress."""
+    loaded_count = 0
+    start = perf_counter()
 
-def import_collection_from_file(db, collection_name: str, file_path: str):
-    """Helper function to import data from a JSON file into a specified collection."""
     try:
-        with open(file_path, 'r') as file:
-            for line in file:
-                data = json.loads(line[:-1])
-                data.pop('_id', None)
-                if isinstance(data, list):
-                    db[collection_name].insert_many(data)
-                else:
-                    db[collection_name].insert_one(data)
-        logger.info(f"Imported {collection_name} data from {file_path}")
+        batch = []
+        for document in read_backup_documents(file_path):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                write_batch(batch)
+                loaded_count += len(batch)
+                batch = []
+                if loaded_count % (batch_size * 10) == 0:
+                    rate = loaded_count / max(perf_counter() - start, 1e-9)
+                    logger.info(f"Loaded {loaded_count} documents into '{collection_name}' ({rate:.0f} docs/s)")
+        if batch:
+            write_batch(batch)
+            loaded_count += len(batch)
+
+        elapsed = perf_counter() - start
+        logger.info(f"Loaded {loaded_count} {collection_name} documents from {file_path} in {elapsed:.1f}s ({loaded_count / max(elapsed, 1e-9):.0f} docs/s)")
+        return loaded_count
     except Exception as e:
-        logger.error(f"Failed to import collection '{collection_name}' from file '{file_path}': {e}")
+        logger.error(f"Failed to load collection '{collection_name}' from file '{file_path}': {e}")
         raise
 
-def import_backup(client: MongoClient, db_name: str, collections_map):
-    """Import collections into the specified MongoDB database."""
+def import_collection_from_file(db, collection_name: str, file_path: str, batch_size: int = 1000) -> int:
+    """Helper function to import data from a backup file into a specified collection in unordered batches."""
+    collection = db[collection_name]
+    return load_documents_in_batches(
+        collection_name, file_path, batch_size,
+        lambda batch: collection.insert_many(batch, ordered=False)
+    )
+
+def apply_collection_changes(db, collection_name: str, file_path: str, batch_size: int = 1000) -> int:
+    """Replay the documents of a differential backup file on top of a restored collection, matching on _id."""
+    collection = db[collection_name]
+    return load_documents_in_batches(
+        collection_name, file_path, batch_size,
+        lambda batch: collection.bulk_write([ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in batch], ordered=False)
+    )
+
+def restore_collection(db, collection_name: str, file_path: str, differential_path: str, batch_size: int):
+    """Import a collection from a full snapshot, then replay the differential backup of it if one is given."""
+    import_collection_from_file(db, collection_name, file_path, batch_size)
+    if differential_path:
+        changes_path = find_backup_file(differential_path, collection_name)
+        if changes_path:
+            apply_collection_changes(db, collection_name, changes_path, batch_size)
+
+def import_backup(client: MongoClient, db_name: str, collections_map, differential_path: str = None):
+    """Import collections into the specified MongoDB database, optionally restoring collections in parallel.
+    When a differential backup is given, its changes are replayed on top of each imported collection."""
     db = client[db_name]
+    restore_config = load_restore_config()
     try:
-        for collection_name, file_path in collections_map.items():
-            if collection_is_empty(db, collection_name):
-                import_collection_from_file(db, collection_name, file_path)
+        pending = {
+            collection_name: file_path
+            for collection_name, file_path in collections_map.items()
+            if collection_is_empty(db, collection_name)
+        }
+        max_workers = len(pending) if restore_config['parallel'] else 1
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            futures = [
+                executor.submit(restore_collection, db, collection_name, file_path, differential_path, restore_config['batch_size'])
+                for collection_name, file_path in pending.items()
+            ]
+            for future in as_completed(futures):
+                future.result()
+        # Restored data may predate the applied migrations.
+        reset_migrations(db)
     except Exception as e:
         logger.error(f"Error importing backup: {e}")
         raise
 
 def check_and_import():
-    """Check if a database exists and is non-empty. If it doesn't exist or is empty, import a backup."""
+    """Check if a database exists and is non-empty. If it doesn't exist or is empty, import a backup.
+    Afterwards ensure the indexes exist, apply pending migrations and check that hot queries use them."""
     mongodb_config = load_mongodb_config()
     backup_dir = mongodb_config['backup_dir']
     db_name = mongodb_config['database']
     
     client = get_client()
-    collections_map = generate_collections_map(backup_dir)
-    
     try:
-        if not db_exists(client, db_name):
-            logger.info(f"Database '{db_name}' does not exist. Creating and importing backup.")
-            import_backup(client, db_name, collections_map)
+        restore_chain = get_restore_chain(backup_dir)
+        collections_map = generate_collections_map(restore_chain[0])
+        differential_path = restore_chain[1] if len(restore_chain) > 1 else None
+    except FileNotFoundError as e:
+        logger.error(e)
+        collections_map, differential_path = {}, None
+    
+    if not db_exists(client, db_name):
+        logger.info(f"Database '{db_name}' does not exist. Creating and importing backup.")
+        import_backup(client, db_name, collections_map, differential_path)
+    else:
+        db = client[db_name]
+        required_collections = set(collections_map.keys())
+        existing_collections = set(db.list_collection_names())
+
+        missing_or_empty_collections = required_collections - existing_collections | {
+            col for col in required_collections & existing_collections if collection_is_empty(db, col)}
+
+        if missing_or_empty_collections:
+            logger.info("Some collections are missing or empty. Importing backup.")
+            import_backup(client, db_name, collections_map, differential_path)
         else:
-            db = client[db_name]
-            required_collections = set(collections_map.keys())
-            existing_collections = set(db.list_collection_names())
+            logger.info("All required collections are present and non-empty. No action needed.")
 
-            missing_or_empty_collections = required_collections - existing_collections | {
-                col for col in required_collections & existing_collections if collection_is_empty(db, col)}
+    db = client[db_name]
+    run_migrations(db, PRE_INDEX_MIGRATIONS)
+    failed_indexes = ensure_indexes(db)
+    run_migrations(db)
+    verify_query_plans(db, strict=not failed_indexes)
 
-            if missing_or_empty_collections:
-                logger.info("Some collections are missing or empty. Importing backup.")
-                import_backup(client, db_name, collections_map)
-            else:
-                logger.info("All required collections are present and non-empty. No action needed.")
-    finally:
-        client.close()
-        logger.info("MongoDB connection closed.")
+def load_backup_config() -> dict:
+    """Load backup export settings, falling back to defaults for missing keys."""
+    config = load_config()
+    return {
+        'format': resolve_format(config.get('MONGODB', 'backup_format', fallback='json')),
+        'compression': resolve_compression(config.get('MONGODB', 'backup_compression', fallback='gzip')),
+        'level': config.getint('MONGODB', 'backup_compression_level', fallback=6),
+        'mode': config.get('MONGODB', 'backup_mode', fallback=BACKUP_FULL),
+        'full_interval': config.getint('MONGODB', 'full_backup_interval', fallback=6),
+    }
+
+def load_restore_config() -> dict:
+    """Load backup import settings, falling back to defaults for missing keys."""
+    config = load_config()
+    return {
+        'batch_size': config.getint('MONGODB', 'backup_import_batch_size', fallback=1000),
+        'parallel': config.getboolean('MONGODB', 'backup_import_parallel', fallback=True),
+    }
+
+def export_collection(db, collection_name: str, output_dir: str, backup_format: str, compression: str, level: int, criteria: dict = None) -> dict:
+    """Stream the matching documents of a collection into a compressed backup file and return its manifest entry."""
+    file_path = os.path.join(output_dir, backup_file_name(collection_name, compression, backup_format))
+    if backup_format == 'bson':
+        # Fetch documents as raw bytes so they are written out without being decoded.
+        collection = db[collection_name].with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        with collection.find(criteria or {}) as cursor:
+            entry = write_raw_bson(cursor, file_path, compression, level)
+    else:
+        with db[collection_name].find(criteria or {}) as cursor:
+            entry = write_json_lines(cursor, file_path, compression, level)
+    logger.info(f"Exported {entry['count']} documents from '{collection_name}' to {file_path}")
+    return entry
+
+def write_manifest(output_dir: str, manifest: dict):
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+def find_differential_base(entries: list, dir_name: str, full_interval: int):
+    """Return the catalog entry of the full snapshot a new differential backup can build on, or None
+    when a new full snapshot is due."""
+    differential_count = 0
+    for entry in reversed(entries):
+        if entry['type'] == BACKUP_DIFFERENTIAL:
+            differential_count += 1
+            continue
+        # Backups without watermarks predate differential backups and cannot serve as a base.
+        if 'watermarks' not in entry:
+            return None
+        if entry['name'] == dir_name or differential_count >= full_interval:
+            return None
+        return entry
+    return None
+
+def changed_since(watermark: datetime) -> dict:
+    """Match documents updated or inserted at or after the watermark."""
+    return {'$or': [
+        {'updated_at': {'$gte': watermark}},
+        {'_id': {'$gte': ObjectId.from_datetime(watermark)}},
+    ]}
 
 def export_backups():
+    """Export every collection in parallel, one compressed file per collection, plus a manifest.
+
+    In incremental mode only documents changed since the last full snapshot are written (a differential
+    backup), and a new full snapshot is taken every full_backup_interval backups. Deletions are not
+    captured; the application never deletes documents."""
     mongodb_config = load_mongodb_config()
     backup_dir = mongodb_config['backup_dir']
     db_name = mongodb_config['database']
+    backup_config = load_backup_config()
     client = get_client()
     db = client[db_name]
 
-    dir_name = f"{db_name}_{datetime.now().strftime('%Y_%m_%d_%H_%M')}"
+    created = datetime.now()
+    watermark = utc_now()
+    dir_name = f"{db_name}_{created.strftime('%Y_%m_%d_%H_%M')}"
     output_dir = os.path.join(backup_dir, dir_name)
+
+    catalog = load_catalog(backup_dir)
+    base = None
+    if backup_config['mode'] == 'incremental':
+        base = find_differential_base(catalog, dir_name, backup_config['full_interval'])
+    since = {name: datetime.fromisoformat(value) for name, value in base['watermarks'].items()} if base else {}
+
     os.makedirs(output_dir, exist_ok=True)
-    
-    for collection_name in db.list_collection_names():
-        filepath = os.path.join(output_dir, f"{collection_name}.json")
-        with open(filepath, 'w') as file:
-            for document in db[collection_name].find():
-                json_str = json_util.dumps(document)
-                file.write(f"{json_str}\n")
+
+    collection_names = db.list_collection_names()
+    collections = {}
+    with ThreadPoolExecutor(max_workers=max(len(collection_names), 1)) as executor:
+        future_to_collection = {
+            executor.submit(
+                export_collection, db, name, output_dir, backup_config['format'], backup_config['compression'], backup_config['level'],
+                changed_since(since[name]) if name in since else None
+            ): name
+            for name in collection_names
+        }
+        for future in as_completed(future_to_collection):
+            collections[future_to_collection[future]] = future.result()
+
+    manifest = {
+        'database': db_name,
+        'created': created.isoformat(),
+        'type': BACKUP_DIFFERENTIAL if base else BACKUP_FULL,
+        'format': backup_config['format'],
+        'compression': backup_config['compression'],
+        'level': backup_config['level'],
+        'collections': collections,
+    }
+    if base:
+        manifest['base'] = base['name']
+        manifest['since'] = base['watermarks']
+    else:
+        manifest['watermarks'] = {name: watermark.isoformat() for name in collection_names}
+    write_manifest(output_dir, manifest)
+
+    catalog = [entry for entry in catalog if entry['name'] != dir_name]
+    catalog.append({**manifest, 'name': dir_name})
+    save_catalog(backup_dir, catalog)
+    logger.info(f"{manifest['type'].capitalize()} backup written to {output_dir}")
+
+def find_orphaned_backups(backup_dir: str, catalog: list) -> list:
+    """Return backup directories the catalog does not list that are older than its newest entry, e.g.
+    exports that failed before the catalog was saved. Newer ones may still be being written."""
+    if not catalog:
+        return []
+    newest = parse_backup_timestamp(catalog[-1]['name'])
+    listed = {entry['name'] for entry in catalog}
+    orphaned = []
+    for name in os.listdir(backup_dir):
+        if name in listed or not os.path.isdir(os.path.join(backup_dir, name)):
+            continue
+        try:
+            created = parse_backup_timestamp(name)
+        except ValueError:
+            continue
+        if created < newest:
+            orphaned.append(name)
+    return orphaned
 
 def clean_backups():
+    """Keep the three newest backups in the catalog and the full snapshots they depend on, and remove
+    older backup directories that never made it into the catalog."""
     mongodb_config = load_mongodb_config()
     backup_dir = mongodb_config['backup_dir']
-    subdirs = [os.path.join(backup_dir, d) for d in os.listdir(backup_dir) if os.path.isdir(os.path.join(backup_dir, d))]
-    subdirs.sort(key=os.path.getmtime, reverse=True)
-    
-    for old_dir in subdirs[3:]:
-        rmtree(old_dir)
+    catalog = load_catalog(backup_dir)
+
+    keep = {entry['name'] for entry in catalog[-3:]}
+    keep |= {entry['base'] for entry in catalog[-3:] if entry['type'] == BACKUP_DIFFERENTIAL}
+
+    for entry in catalog:
+        if entry['name'] not in keep:
+            rmtree(os.path.join(backup_dir, entry['name']), ignore_errors=True)
+    for name in find_orphaned_backups(backup_dir, catalog):
+        logger.info(f"Removing backup directory '{name}', which is not in the catalog.")
+        rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+    save_catalog(backup_dir, [entry for entry in catalog if entry['name'] in keep])
@@ -1,242 +1,214 @@
 from datetime import datetime
 import logging
-from pymongo import MongoClient
-from pymongo.collection import Collection
+from pymongo import UpdateMany, UpdateOne, errors
 
-from database.db_helper_functions import get_client, load_mongodb_config
+from database.db_helper_functions import get_collection, get_cursor_batch_size, utc_now
+from database.write_batcher import get_write_batcher
 from utils.helper_functions import get_job_id_from_url
 
 logger = logging.getLogger(__name__)
 
-def get_existing_job_ids(collection: Collection, job_ids: list[str]) -> set[str]:
-    """Fetch existing job IDs from the collection"""
-    return set(
-        doc['job_id'] for doc in collection.find({'job_id': {'$in': job_ids}}, {'job_id': 1})
-    )
+INGEST_CHUNK_SIZE = 1000
 
-def fetch_new_job_ids(client: MongoClient, db_name: str, bookmark_urls: list) -> list:
-    """Get new job IDs not present in the job_postings collection"""
-    job_ids = [get_job_id_from_url(url) for url in bookmark_urls]
-    job_postings_collection = client[db_name]['job_postings']
+# Lifecycle of a job posting; each stage only ever advances to the next one.
+STAGE_DISCOVERED = 'discovered'
+STAGE_SCRAPED = 'scraped'
+STAGE_SKILLS_READY = 'skills_ready'
+STAGE_TAILORED = 'tailored'
+STAGES = (STAGE_DISCOVERED, STAGE_SCRAPED, STAGE_SKILLS_READY, STAGE_TAILORED)
+# Postings a resume is tailored for.
+RESUME_CRITERIA = {'stage': STAGE_SKILLS_READY, 'general': False}
 
+def extract_unique_job_ids(bookmark_urls: list) -> list:
+    """Map bookmark URLs to job IDs, dropping duplicates and URLs without a job ID while keeping order."""
+    job_ids = [get_job_id_from_url(url) for url in bookmark_urls]
+    unrecognized_count = sum(1 for job_id in job_ids if job_id is None)
+    if unrecognized_count:
+        logger.warning(f"Skipped {unrecognized_count} bookmarks that are not LinkedIn job postings.")
+    return list(dict.fromkeys(job_id for job_id in job_ids if job_id is not None))
+
+def collect_new_job_postings(bookmark_urls: list, chunk_size: int = INGEST_CHUNK_SIZE) -> tuple[int, int, int]:
+    """Upsert job postings for the bookmarked URLs and return the number inserted, already present and failed.
+    A chunk that fails is logged and the remaining chunks are still written."""
+    job_ids = extract_unique_job_ids(bookmark_urls)
+    collection = get_collection('job_postings')
+    inserted_count = 0
+    failed_count = 0
+
+    for start in range(0, len(job_ids), chunk_size):
+        upserts = [
+            UpdateOne({'job_id': job_id}, {'$setOnInsert': {'job_id': job_id, 'stage': STAGE_DISCOVERED, 'updated_at': utc_now()}}, upsert=True)
+            for job_id in job_ids[start:start + chunk_size]
+        ]
+        try:
+            result = collection.bulk_write(upserts, ordered=False)
+            inserted_count += result.upserted_count
+        except errors.BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            inserted_count += e.details.get('nUpserted', 0)
+            failed_count += len(write_errors)
+            logger.error(f"Failed to insert {len(write_errors)} job postings: {write_errors[:3]}")
+        except Exception as e:
+            failed_count += len(upserts)
+            logger.error(f"An error occurred while inserting {len(upserts)} job postings: {e}")
+
+    existing_count = len(job_ids) - inserted_count - failed_count
+    logger.info(f"Inserted {inserted_count} new job postings; {existing_count} were already present.")
+    if failed_count:
+        logger.error(f"Failed to insert {failed_count} job postings; they will be retried on the next run.")
+    return inserted_count, existing_count, failed_count
+
+def find_postings_in_stage(stage: str) -> list:
+    """Return the job IDs of postings currently in the given stage."""
+    collection = get_collection('job_postings')
     try:
-        existing_job_ids = get_existing_job_ids(job_postings_collection, job_ids)
-        new_job_ids = [id for id in job_ids if id not in existing_job_ids]
-
-        if new_job_ids:
-            logger.info(f"Found {len(new_job_ids)} new job postings.")
-        else:
-            logger.info("All job postings are already present in the collection.")
-        
-        return new_job_ids
+        job_ids = [doc['job_id'] for doc in collection.find({'stage': stage}, {'_id': 0, 'job_id': 1})]
+        logger.info(f"Found {len(job_ids)} job postings in the '{stage}' stage.")
+        return job_ids
     except Exception as e:
-        logger.error(f"An error occurred while checking job postings: {e}")
+        logger.error(f"An error occurred while finding job postings in the '{stage}' stage: {e}")
         return []
 
-def collect_new_job_postings(bookmark_urls: list) -> list:
-    """Insert new job postings into the job_postings collection"""
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    
-    try:
-        new_job_ids = fetch_new_job_ids(client, db_name, bookmark_urls)
-        if new_job_ids:
-            new_job_documents = [{'job_id': job_id} for job_id in new_job_ids]
-            insertion_result = client[db_name]['job_postings'].insert_many(new_job_documents)
-            logger.info(f"Inserted {len(insertion_result.inserted_ids)} job postings into the collection.")
-        else:
-            logger.info("No new job postings to insert.")
-    except Exception as e:
-        logger.error(f"An error occurred while inserting job postings: {e}")
-    finally:
-        client.close()
-
-    return new_job_ids
-
-def find_documents_missing_field(collection_name: str, key_name: str, field_name: str) -> list:
-    """Find documents in the specified collection that lack a specified field."""
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    collection = client[db_name][collection_name]
-    try:
-        query_results = collection.find({field_name: {"$exists": False}}, {"_id": 0, key_name: 1})
-        documents_missing_field = [doc[key_name] for doc in query_results]
-        
-        logger.info(f"Found {len(documents_missing_field)} documents without the {field_name} field.")
-        return documents_missing_field
-    except Exception as e:
-        logger.error(f"An error occurred while finding documents without the {field_name} field: {e}")
-        return []
-    finally:
-        client.close()
-    
-def propagate_skills_field_across_docs():
-    """Propagate the skills field across documents with matching company and role, and return IDs of updated documents."""
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    collection = client[db_name]["job_postings"]
+def advance_stage(job_id: str, stage: str, fields: dict = None):
+    """Queue an atomic move of a posting to the given stage together with the fields produced by that stage.
+    Postings already at or past the stage are left untouched."""
+    earlier_stages = list(STAGES[:STAGES.index(stage)])
+    query = {'job_id': job_id, 'stage': {'$in': earlier_stages}}
+    update = {'$set': {**(fields or {}), 'stage': stage, 'updated_at': utc_now()}}
+
+    get_write_batcher().add('job_postings', UpdateOne(query, update))
+
+def propagate_skills_field_across_docs() -> int:
+    """Propagate the skills field across documents with matching company and role, and return the number of updated documents."""
+    collection = get_collection("job_postings")
     
     try:
         aggregation_pipeline = [
+            {"$project": {"_id": 0, "company": 1, "role": 1, "skills": 1, "stage": 1}},
             {
                 "$group": {
                     "_id": {"company": "$company", "role": "$role"},
-                    "documents": {"$push": "$$ROOT"},
-                    "skills_count": {"$sum": {"$cond": [{"$ifNull": ["$skills", False]}, 1, 0]}}
+                    "skills": {"$max": "$skills"},
+                    "skills_count": {"$sum": {"$cond": [{"$ifNull": ["$skills", False]}, 1, 0]}},
+                    "scraped_count": {"$sum": {"$cond": [{"$eq": ["$stage", STAGE_SCRAPED]}, 1, 0]}}
                 }
             },
-            {"$match": {"skills_count": {"$gte": 1}}}
+            {"$match": {"skills_count": {"$gte": 1}, "scraped_count": {"$gte": 1}}},
+            {"$project": {"skills": 1}}
         ]
         
-        aggregated_groups = list(collection.aggregate(aggregation_pipeline))
-        
-        for group in aggregated_groups:
-            skills_to_propagate = None
-            
-            for document in group['documents']:
-                if 'skills' in document:
-                    skills_to_propagate = document['skills']
-                    break
-            
-            if skills_to_propagate:
-                for document in group['documents']:
-                    if 'skills' not in document:
-                        collection.update_one(
-                            {"_id": document['_id']},
-                            {"$set": {"skills": skills_to_propagate}}
-                        )
+        updates = [
+            UpdateMany(
+                {"company": group["_id"].get("company"), "role": group["_id"].get("role"), "stage": STAGE_SCRAPED},
+                {"$set": {"skills": group["skills"], "stage": STAGE_SKILLS_READY, "updated_at": utc_now()}}
+            )
+            for group in collection.aggregate(aggregation_pipeline)
+        ]
         
-        logger.info("Skills field successfully propagated across matching documents.")
+        if not updates:
+            logger.info("No documents are missing skills shared by a matching company and role.")
+            return 0
+
+        result = collection.bulk_write(updates, ordered=False)
+        logger.info(f"Skills field propagated to {result.modified_count} documents across {len(updates)} company and role groups.")
+        return result.modified_count
     except Exception as e:
         logger.error(f"An error occurred while propagating the skills field: {e}")
-    finally:
-        client.close()
-
-def get_documents(collection_name: str, criteria: dict, fields: list) -> list:
-    """Query job_postings collection based on specific criteria."""
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    collection = client[db_name][collection_name]
-    
-    projection = {field: 1 for field in fields}
-    results_cursor = collection.find(criteria, projection)
-    
-    job_listings = []
-    for document in results_cursor:
-        job_listings.append(document)
-    
-    client.close()
-    
-    return job_listings
-
-def update_field(collection_name, search_field, search_value, update_field, new_value):
-    """Update a field in a MongoDB document where a specified field matches a value."""
-    client = get_client()
-    try:
-        config = load_mongodb_config()
-        db_name = config['database']
-        collection = client[db_name][collection_name]
-
-        query = {search_field: search_value}
-        update = {"$set": {update_field: new_value}}
-
-        collection.update_one(query, update)
+        return 0
 
-    finally:
-        client.close()
+def has_documents(collection_name: str, criteria: dict) -> bool:
+    """Return whether any document matches the criteria, without fetching the rest."""
+    return get_collection(collection_name).find_one(criteria, {'_id': 1}) is not None
 
-def update_many_fields(collection_name, filter_field, filter, update_field, new_value, array_filters={}):
+def build_projection(fields: list) -> dict:
+    """Project only the requested fields, leaving out _id unless it is requested."""
+    projection = {field: 1 for field in fields}
+    projection.setdefault('_id', 0)
+    return projection
+
+def iter_documents(collection_name: str, criteria: dict, fields: list, batch_size: int = None):
+    """Yield documents matching the criteria one page at a time.
+
+    Pages are fetched by _id ranges, each through its own short-lived cursor, so memory stays
+    bounded by batch_size and no server cursor is held open while the caller is busy."""
+    batch_size = batch_size or get_cursor_batch_size()
+    collection = get_collection(collection_name)
+    projection = build_projection(fields)
+    include_id = projection['_id'] == 1
+    projection['_id'] = 1
+
+    last_id = None
+    while True:
+        page_criteria = criteria if last_id is None else {'$and': [criteria, {'_id': {'$gt': last_id}}]}
+        with collection.find(page_criteria, projection, sort=[('_id', 1)], limit=batch_size, batch_size=batch_size) as cursor:
+            page = list(cursor)
+
+        if not page:
+            return
+        last_id = page[-1]['_id']
+
+        for document in page:
+            if not include_id:
+                del document['_id']
+            yield document
+
+        if len(page) < batch_size:
+            return
+
+def update_many_fields(collection_name, filter_field, filter, update_field, new_value, array_filters=None):
     """Update many fields in MongoDB where a specified field matches a value."""
-    client = get_client()
-    try:
-        config = load_mongodb_config()
-        db_name = config['database']
-        collection = client[db_name][collection_name]
-
-        query = {filter_field: filter}
-        update = {"$set": {update_field: new_value}}
+    collection = get_collection(collection_name)
 
-        collection.update_many(query, update, array_filters=array_filters)
+    query = {filter_field: filter}
+    update = {"$set": {update_field: new_value, "updated_at": utc_now()}}
 
-    finally:
-        client.close()
-
-def insert_document(collection_name, document):
-    """Inserts a document into a specific MongoDB collection."""
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    collection = client[db_name][collection_name]
-
-    try:
-        collection.insert_one(document)
-    
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
-    finally:
-        client.close()
+    collection.update_many(query, update, array_filters=array_filters)
 
 def insert_skill(skill: str):
-    """Inserts a skill document into bullet_points collection if it doesn't exist."""
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    collection = client[db_name]['bullet_points']
-
+    """Queues an upsert of a skill document into bullet_points collection so it is only created if it doesn't exist."""
     try:
         s = skill.lower()
-        if collection.count_documents({'skill': s}) == 0:
-            collection.insert_one({'skill': s})
+        get_write_batcher().add('bullet_points', UpdateOne({'skill': s}, {'$setOnInsert': {'skill': s, 'updated_at': utc_now()}}, upsert=True))
     
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
-    finally:
-        client.close()
 
-def update_skill_bullets(skill, verified_achievements):
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    collection = client[db_name]['bullet_points']
+def find_skills_without_bullets() -> list:
+    """Return the skills in bullet_points that have no bullets yet."""
+    skills_with_bullets = get_collection('bullets').distinct('skill')
+    query_results = get_collection('bullet_points').find({'skill': {'$nin': skills_with_bullets}}, {'_id': 0, 'skill': 1})
+    skills = [doc['skill'] for doc in query_results]
+
+    logger.info(f"Found {len(skills)} skills without bullets.")
+    return skills
 
-    document = collection.find_one({'skill': skill})
-    if not document:
+def update_skill_bullets(skill, verified_achievements):
+    """Add one bullet document per verb for a skill. Bullets that already exist are left untouched."""
+    if not get_collection('bullet_points').find_one({'skill': skill}, {'_id': 1}):
         raise ValueError('Document not found')
 
-    bullets = document.get('bullets', [])
     current_time = datetime.now()
-
-    new_bullets = [
-        {
-            'verb': verb,
-            'bullet': bullet,
-            'created_date': current_time,
-            'resume_reference': current_time
-        }
+    upserts = [
+        UpdateOne(
+            {'skill': skill, 'verb': verb, 'bullet': bullet},
+            {'$setOnInsert': {'created_date': current_time, 'resume_reference': current_time, 'updated_at': utc_now()}},
+            upsert=True
+        )
         for verb, bullet in verified_achievements.items()
     ]
 
-    bullets.extend(new_bullets)
-    collection.update_one({'skill': skill}, {'$set': {'bullets': bullets}})
+    if upserts:
+        get_collection('bullets').bulk_write(upserts, ordered=False)
 
-def get_aggregated_data(collection_name, pipeline):
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    bullets_collection = client[db_name][collection_name]
-    return bullets_collection.aggregate(pipeline)
+def iter_aggregated_data(collection_name, pipeline, batch_size: int = None):
+    """Yield the results of an aggregation, closing the cursor once iteration stops."""
+    batch_size = batch_size or get_cursor_batch_size()
+    with get_collection(collection_name).aggregate(pipeline, batchSize=batch_size) as cursor:
+        yield from cursor
 
 def score_bullet_quality(agg):
-    client = get_client()
-    config = load_mongodb_config()
-    db_name = config['database']
-    bullets_collection = client[db_name]["bullet_points"]
+    bullets_collection = get_collection("bullets")
 
     scored_agg = {}
 
@@ -257,10 +229,7 @@ def score_bullet_quality(agg):
                     except ValueError:
                         print("Invalid input. Please enter an integer between 1 and 5.")
 
-                bullets_collection.update_one(
-                    {'skill': skill, 'bullets.verb': verb, 'bullets.bullet': bullet['bullet']},
-                    {'$set': {'bullets.$.quality': score}}
-                )
+                bullets_collection.update_one({'_id': bullet['id']}, {'$set': {'quality': score, 'updated_at': utc_now()}})
 
                 scored_agg[verb][skill] = bullet.copy()
                 scored_agg[verb][skill]['quality'] = score
@@ -1,9 +1,17 @@
+import atexit
 import logging
+import os
+from datetime import datetime, timezone
+from threading import Lock
 from pymongo import MongoClient, errors
 from config.settings import load_config
 
 logger = logging.getLogger(__name__)
 
+_client = None
+_client_pid = None
+_client_lock = Lock()
+
 def load_mongodb_config() -> dict:
     """Load MongoDB configuration from settings."""
     try:
@@ -14,8 +22,24 @@ def load_mongodb_config() -> dict:
         logger.error(f"Missing configuration key: {e}")
         raise
 
-def get_client() -> MongoClient:
-    """Establish a connection to the MongoDB database."""
+def load_pool_config() -> dict:
+    """Load MongoDB connection pool settings, falling back to defaults for missing keys."""
+    config = load_config()
+    return {
+        'maxPoolSize': config.getint('MONGODB', 'max_pool_size', fallback=20),
+        'minPoolSize': config.getint('MONGODB', 'min_pool_size', fallback=0),
+        'maxIdleTimeMS': config.getint('MONGODB', 'max_idle_time_ms', fallback=60000),
+        'connectTimeoutMS': config.getint('MONGODB', 'connect_timeout_ms', fallback=10000),
+        'serverSelectionTimeoutMS': config.getint('MONGODB', 'server_selection_timeout_ms', fallback=10000),
+        'socketTimeoutMS': config.getint('MONGODB', 'socket_timeout_ms', fallback=60000),
+    }
+
+def get_cursor_batch_size() -> int:
+    """Return the number of documents to fetch per round trip when streaming query results."""
+    return load_config().getint('MONGODB', 'cursor_batch_size', fallback=100)
+
+def create_client() -> MongoClient:
+    """Establish a new pooled connection to the MongoDB database."""
     try:
         config = load_mongodb_config()
         logger.info("Connecting to MongoDB...")
@@ -24,7 +48,8 @@ def get_client() -> MongoClient:
             port=27017,
             username=config['username'],
             password=config['password'],
-            authSource="admin"
+            authSource="admin",
+            **load_pool_config()
         )
         client.admin.command('ping')  # Verify the connection by pinging the server
         logger.info("MongoDB connection established.")
@@ -32,3 +57,43 @@ def get_client() -> MongoClient:
     except (errors.ConnectionFailure, errors.PyMongoError) as e:
         logger.error(f"MongoDB connection error: {e}")
         raise
+
+def get_client() -> MongoClient:
+    """Return the process-wide MongoDB client, creating it on first use or after a fork."""
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            # A client inherited from a parent process must not be reused or closed by the child.
+            _client = create_client()
+            _client_pid = pid
+        return _client
+
+def close_client():
+    """Close the process-wide MongoDB client if this process opened it."""
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+            logger.info("MongoDB connection closed.")
+        _client = None
+        _client_pid = None
+
+def utc_now() -> datetime:
+    """Timestamp stamped into updated_at by every write, used as the watermark for differential backups."""
+    return datetime.now(timezone.utc)
+
+def get_database():
+    """Return the configured database from the shared client."""
+    return get_client()[load_config()['MONGODB']['database']]
+
+def get_collection(collection_name: str):
+    """Return a collection from the configured database on the shared client."""
+    return get_database()[collection_name]
+
+atexit.register(close_client)
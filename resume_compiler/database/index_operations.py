@@ -0,0 +1,98 @@
+import logging
+from pymongo import ASCENDING, IndexModel, errors
+
+from database.database_operations import STAGE_SCRAPED, STAGE_SKILLS_READY
+from database.db_helper_functions import get_database
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    'job_postings': [
+        IndexModel([('job_id', ASCENDING)], name='job_id_unique', unique=True),
+        IndexModel([('stage', ASCENDING), ('general', ASCENDING)], name='stage_general'),
+        IndexModel([('skills', ASCENDING)], name='skills'),
+        IndexModel([('updated_at', ASCENDING)], name='updated_at'),
+    ],
+    'bullet_points': [
+        IndexModel([('skill', ASCENDING)], name='skill_unique', unique=True),
+        IndexModel([('updated_at', ASCENDING)], name='updated_at'),
+    ],
+    'bullets': [
+        IndexModel([('skill', ASCENDING), ('verb', ASCENDING), ('bullet', ASCENDING)], name='skill_verb_bullet_unique', unique=True),
+        IndexModel([('verb', ASCENDING)], name='verb'),
+        IndexModel([('quality', ASCENDING)], name='quality'),
+        IndexModel([('resume_reference', ASCENDING)], name='resume_reference'),
+        IndexModel([('bullet', ASCENDING)], name='bullet'),
+        IndexModel([('updated_at', ASCENDING)], name='updated_at'),
+    ],
+}
+
+# Filters issued by the hot paths of a run; each one must be answered by an index.
+HOT_QUERIES = {
+    'job_postings': [
+        {'job_id': ''},
+        {'stage': STAGE_SCRAPED},
+        {'stage': STAGE_SKILLS_READY, 'general': False},
+    ],
+    'bullet_points': [
+        {'skill': ''},
+    ],
+    'bullets': [
+        {'skill': {'$in': ['']}},
+        {'bullet': {'$in': ['']}},
+    ],
+}
+
+def ensure_indexes(db=None) -> list:
+    """Create the indexes the application relies on. Safe to call on every run.
+    An index that cannot be built, e.g. a unique index over duplicate keys, is logged and skipped so the
+    others still get built. Returns the names of the failed indexes."""
+    db = db if db is not None else get_database()
+    failed = []
+    for collection_name, indexes in INDEXES.items():
+        created = []
+        for index in indexes:
+            try:
+                created.extend(db[collection_name].create_indexes([index]))
+            except errors.OperationFailure as e:
+                name = index.document['name']
+                logger.error(f"Failed to create index '{name}' on '{collection_name}': {e}")
+                failed.append(f"{collection_name}.{name}")
+        logger.info(f"Ensured indexes on '{collection_name}': {', '.join(created)}")
+    return failed
+
+def get_plan_stages(plan: dict) -> list:
+    """Flatten a query plan tree into the list of its stage names."""
+    stages = [plan.get('stage')] if 'stage' in plan else []
+    for key in ('queryPlan', 'inputStage'):
+        if key in plan:
+            stages.extend(get_plan_stages(plan[key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(get_plan_stages(child))
+    return stages
+
+def explain_query(collection, criteria: dict) -> list:
+    """Return the stage names of the winning plan for a find on the given collection."""
+    explanation = collection.find(criteria).explain()
+    return get_plan_stages(explanation['queryPlanner']['winningPlan'])
+
+def verify_query_plans(db=None, strict=True):
+    """Raise if any hot query would fall back to a collection scan. With strict off, e.g. while an index
+    is known to be missing, only log them."""
+    db = db if db is not None else get_database()
+    collection_scans = []
+    for collection_name, queries in HOT_QUERIES.items():
+        for criteria in queries:
+            stages = explain_query(db[collection_name], criteria)
+            logger.debug(f"Query plan for {collection_name} {criteria}: {stages}")
+            if 'COLLSCAN' in stages:
+                collection_scans.append(f"{collection_name} {criteria}")
+
+    if collection_scans:
+        message = f"Hot queries fall back to COLLSCAN: {'; '.join(collection_scans)}"
+        logger.error(message)
+        if strict:
+            raise RuntimeError(message)
+        return
+
+    logger.info("All hot queries are served by indexes.")
@@ -0,0 +1,150 @@
+import logging
+from datetime import datetime
+from pymongo import errors
+
+from database.database_operations import STAGE_DISCOVERED, STAGE_SCRAPED, STAGE_SKILLS_READY, STAGE_TAILORED, STAGES
+from database.db_helper_functions import get_database, utc_now
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_COLLECTION = 'schema_migrations'
+
+def migrate_job_posting_stage(db):
+    """Derive the stage of postings created before the stage field existed."""
+    result = db['job_postings'].update_many(
+        {'stage': {'$exists': False}},
+        [{'$set': {'stage': {'$switch': {
+            'branches': [
+                {'case': {'$eq': ['$tailored', True]}, 'then': STAGE_TAILORED},
+                {'case': {'$ne': [{'$type': '$skills'}, 'missing']}, 'then': STAGE_SKILLS_READY},
+                {'case': {'$ne': [{'$type': '$description'}, 'missing']}, 'then': STAGE_SCRAPED},
+            ],
+            'default': STAGE_DISCOVERED
+        }}, 'updated_at': utc_now()}}]
+    )
+    logger.info(f"Derived the stage of {result.modified_count} job postings.")
+
+    # The stage index replaces the partial index on the tailored and general flags.
+    try:
+        db['job_postings'].drop_index('pending_tailoring')
+    except errors.OperationFailure:
+        pass
+
+def migrate_embedded_bullets(db):
+    """Move bullets embedded in bullet_points documents into one document per bullet in the bullets collection.
+    Relies on the unique (skill, verb, bullet) index created by ensure_indexes."""
+    db['bullet_points'].aggregate([
+        {'$match': {'bullets.0': {'$exists': True}}},
+        {'$unwind': '$bullets'},
+        {'$replaceWith': {'$mergeObjects': ['$bullets', {'skill': '$skill', 'updated_at': utc_now()}]}},
+        {'$merge': {
+            'into': 'bullets',
+            'on': ['skill', 'verb', 'bullet'],
+            'whenMatched': 'keepExisting',
+            'whenNotMatched': 'insert'
+        }}
+    ])
+    result = db['bullet_points'].update_many({'bullets': {'$exists': True}}, {'$unset': {'bullets': ''}, '$set': {'updated_at': utc_now()}})
+    logger.info(f"Moved embedded bullets of {result.modified_count} skills into the bullets collection.")
+
+    try:
+        db['bullet_points'].drop_index('bullets_bullet')
+    except errors.OperationFailure:
+        pass
+
+def migrate_skills_to_arrays(db):
+    """Convert '^_^'-joined skills strings on job postings into arrays."""
+    result = db['job_postings'].update_many(
+        {'skills': {'$type': 'string'}},
+        [{'$set': {'skills': {'$split': ['$skills', '^_^']}, 'updated_at': utc_now()}}]
+    )
+    logger.info(f"Converted the skills of {result.modified_count} job postings into arrays.")
+
+def posting_progress(doc: dict) -> int:
+    """Rank how far a posting got, deriving the stage the way migrate_job_posting_stage does when it is missing."""
+    if doc.get('stage') in STAGES:
+        return STAGES.index(doc['stage'])
+    if doc.get('tailored') is True:
+        return STAGES.index(STAGE_TAILORED)
+    if 'skills' in doc:
+        return STAGES.index(STAGE_SKILLS_READY)
+    if 'description' in doc:
+        return STAGES.index(STAGE_SCRAPED)
+    return STAGES.index(STAGE_DISCOVERED)
+
+def find_duplicate_groups(collection, key: str):
+    """Yield the _ids of each group of documents sharing a value of key."""
+    pipeline = [
+        {'$group': {'_id': f'${key}', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        yield group['ids']
+
+def dedupe_job_postings(db):
+    """Drop postings without a job_id and keep one posting per job_id: the most advanced one, then the
+    one with the most fields, then the newest."""
+    collection = db['job_postings']
+    result = collection.delete_many({'job_id': {'$not': {'$type': 'string'}}})
+    logger.info(f"Removed {result.deleted_count} job postings without a job_id.")
+
+    removed = 0
+    for ids in find_duplicate_groups(collection, 'job_id'):
+        documents = list(collection.find({'_id': {'$in': ids}}))
+        keep = max(documents, key=lambda doc: (posting_progress(doc), len(doc), doc['_id']))
+        removed += collection.delete_many({'_id': {'$in': [doc['_id'] for doc in documents if doc['_id'] != keep['_id']]}}).deleted_count
+    logger.info(f"Removed {removed} duplicate job postings.")
+
+def dedupe_bullet_points(db):
+    """Drop bullet_points without a skill and keep one document per skill, merging the embedded bullets of the
+    others into it so migrate_embedded_bullets still moves all of them."""
+    collection = db['bullet_points']
+    result = collection.delete_many({'skill': {'$not': {'$type': 'string'}}})
+    logger.info(f"Removed {result.deleted_count} bullet_points documents without a skill.")
+
+    removed = 0
+    for ids in find_duplicate_groups(collection, 'skill'):
+        documents = list(collection.find({'_id': {'$in': ids}}))
+        keep = max(documents, key=lambda doc: (len(doc.get('bullets') or []), len(doc), doc['_id']))
+        others = [doc for doc in documents if doc['_id'] != keep['_id']]
+        bullets = [bullet for doc in others for bullet in doc.get('bullets') or []]
+        if bullets:
+            collection.update_one({'_id': keep['_id']}, {'$addToSet': {'bullets': {'$each': bullets}}, '$set': {'updated_at': utc_now()}})
+        removed += collection.delete_many({'_id': {'$in': [doc['_id'] for doc in others]}}).deleted_count
+    logger.info(f"Removed {removed} duplicate bullet_points documents.")
+
+def dedupe_unique_keys(db):
+    """Collapse documents that would break the unique job_id and skill indexes.
+    The earlier read-then-insert ingest could race and store duplicates or postings without a job_id."""
+    dedupe_job_postings(db)
+    dedupe_bullet_points(db)
+
+# Run before ensure_indexes, since the unique indexes cannot be built over duplicates.
+PRE_INDEX_MIGRATIONS = [
+    ('0004_dedupe_unique_keys', dedupe_unique_keys),
+]
+
+MIGRATIONS = [
+    ('0001_job_posting_stage', migrate_job_posting_stage),
+    ('0002_embedded_bullets', migrate_embedded_bullets),
+    ('0003_skills_arrays', migrate_skills_to_arrays),
+]
+
+def run_migrations(db=None, migrations=None):
+    """Apply every migration that has not yet been recorded as applied to the database.
+    migrations defaults to MIGRATIONS, the ones that run after ensure_indexes."""
+    db = db if db is not None else get_database()
+    migrations = migrations if migrations is not None else MIGRATIONS
+    applied = {doc['_id'] for doc in db[MIGRATIONS_COLLECTION].find({}, {'_id': 1})}
+
+    for name, migration in migrations:
+        if name in applied:
+            continue
+        logger.info(f"Applying migration '{name}'.")
+        migration(db)
+        db[MIGRATIONS_COLLECTION].insert_one({'_id': name, 'applied_at': datetime.now()})
+
+def reset_migrations(db=None):
+    """Forget applied migrations, e.g. after restoring data that may predate them."""
+    db = db if db is not None else get_database()
+    db[MIGRATIONS_COLLECTION].delete_many({})
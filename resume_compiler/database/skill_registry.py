@@ -0,0 +1,85 @@
+import logging
+from threading import Lock
+
+from config.settings import load_config
+from database.database_operations import insert_skill, iter_documents
+from utils.skill_matcher import SkillMatcher, load_aliases
+
+logger = logging.getLogger(__name__)
+
+_registry = None
+_registry_lock = Lock()
+
+class SkillRegistry:
+    """In-memory view of the skills in bullet_points with case-insensitive lookups.
+
+    The skills are read once on first use. New skills are written through to bullet_points,
+    and invalidate() forces the next lookup to read the collection again. search() finds similar
+    skills through a SkillMatcher that is built on first use and extended as skills are added."""
+
+    def __init__(self):
+        self._skills = None
+        self._matcher = None
+        self._lock = Lock()
+
+    def _load(self) -> dict:
+        with self._lock:
+            if self._skills is None:
+                self._skills = {
+                    doc['skill'].lower(): doc['skill']
+                    for doc in iter_documents('bullet_points', {}, ['skill'])
+                    if 'skill' in doc
+                }
+                logger.info(f"Loaded {len(self._skills)} skills into the skill registry.")
+            return self._skills
+
+    def __contains__(self, skill: str) -> bool:
+        return skill.lower() in self._load()
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def get(self, skill: str):
+        """Return the stored spelling of a skill, or None if it is not registered."""
+        return self._load().get(skill.lower())
+
+    def skills(self) -> set:
+        """Return a copy of the registered skills in lower case."""
+        return set(self._load())
+
+    def add(self, skill: str) -> bool:
+        """Register a skill and write it through to bullet_points. Return False if it was already known."""
+        skills = self._load()
+        key = skill.lower()
+        if key in skills:
+            return False
+        insert_skill(key)
+        skills[key] = key
+        with self._lock:
+            if self._matcher is not None:
+                self._matcher.add(key)
+        return True
+
+    def search(self, skill: str, k: int = 10) -> list:
+        """Return up to k (skill, similarity) pairs of registered skills similar to skill, best first."""
+        skills = self._load()
+        with self._lock:
+            if self._matcher is None:
+                aliases_file = load_config().get('SKILL_MATCHER', 'aliases_file', fallback='')
+                self._matcher = SkillMatcher(skills, load_aliases(aliases_file))
+            return self._matcher.search(skill, k)
+
+    def invalidate(self):
+        """Drop the cached skills so the next lookup reloads them."""
+        with self._lock:
+            self._skills = None
+            self._matcher = None
+
+def get_skill_registry() -> SkillRegistry:
+    """Return the process-wide skill registry."""
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = SkillRegistry()
+        return _registry
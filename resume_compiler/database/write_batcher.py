@@ -0,0 +1,130 @@
+import atexit
+import logging
+import os
+from threading import RLock
+from time import monotonic
+from pymongo import errors
+
+from config.settings import load_config
+from database.db_helper_functions import get_collection
+
+logger = logging.getLogger(__name__)
+
+_batcher = None
+_batcher_pid = None
+_batcher_lock = RLock()
+
+class WriteBatchError(errors.PyMongoError):
+    """Buffered operations the server rejected. Every other buffered operation was still written."""
+
+    def __init__(self, failures: list):
+        self.failures = failures
+        collections = sorted({collection_name for collection_name, _, _ in failures})
+        super().__init__(f"{len(failures)} buffered writes were rejected in {', '.join(collections)}.")
+
+class WriteBatcher:
+    """Buffer write operations and send them as ordered bulk writes.
+
+    Pending operations are flushed once max_operations are buffered, once the oldest
+    pending operation is older than max_delay seconds, or when flush() is called.
+    An operation the server rejects is skipped and the rest are still written. The
+    rejections are raised by the next direct flush() call rather than from add(), so
+    they do not surface in whichever caller happened to queue the next write.
+    """
+
+    def __init__(self, max_operations: int = 100, max_delay: float = 5.0):
+        self.max_operations = max_operations
+        self.max_delay = max_delay
+        self._pending = []
+        self._oldest = None
+        self._failures = []
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, collection_name: str, operation):
+        """Queue a pymongo write operation (UpdateOne, InsertOne, ...) for a collection."""
+        with self._lock:
+            if not self._pending:
+                self._oldest = monotonic()
+            self._pending.append((collection_name, operation))
+
+            if len(self._pending) >= self.max_operations or monotonic() - self._oldest >= self.max_delay:
+                self._write_pending()
+
+    def flush(self) -> int:
+        """Send all pending operations, preserving their order. Return the number of operations sent.
+        Raises WriteBatchError for the operations rejected since the last flush() call."""
+        with self._lock:
+            sent = self._write_pending()
+            if self._failures:
+                failures, self._failures = self._failures, []
+                raise WriteBatchError(failures)
+            return sent
+
+    def _write_pending(self) -> int:
+        pending, self._pending, self._oldest = self._pending, [], None
+        if not pending:
+            return 0
+
+        # Consecutive operations on the same collection go out as one ordered bulk write.
+        runs = []
+        for collection_name, operation in pending:
+            if runs and runs[-1][0] == collection_name:
+                runs[-1][1].append(operation)
+            else:
+                runs.append((collection_name, [operation]))
+
+        for position, (collection_name, operations) in enumerate(runs):
+            start = 0
+            while start < len(operations):
+                try:
+                    get_collection(collection_name).bulk_write(operations[start:], ordered=True)
+                    break
+                except errors.BulkWriteError as e:
+                    write_errors = e.details.get('writeErrors') or []
+                    if not write_errors:
+                        # Only the write concern failed; every operation was applied.
+                        logger.error(f"Bulk write to '{collection_name}' failed: {e.details.get('writeConcernErrors')}")
+                        self._failures.append((collection_name, None, e.details))
+                        break
+                    # An ordered bulk write stops at its first error: the operations before it were
+                    # applied, the rejected one is skipped and the rest are sent again.
+                    failed_at = start + write_errors[0]['index']
+                    logger.error(f"Bulk write to '{collection_name}' rejected an operation: {write_errors[0].get('errmsg')}")
+                    self._failures.append((collection_name, operations[failed_at], write_errors[0]))
+                    start = failed_at + 1
+                except errors.PyMongoError:
+                    # Nothing from here on is known to be written, so keep it queued for the next flush.
+                    unsent = [(collection_name, operation) for operation in operations[start:]]
+                    unsent += [(name, operation) for name, run in runs[position + 1:] for operation in run]
+                    self._pending = unsent + self._pending
+                    self._oldest = monotonic()
+                    raise
+
+        logger.debug(f"Flushed {len(pending)} buffered writes in {len(runs)} bulk writes.")
+        return len(pending)
+
+def get_write_batcher() -> WriteBatcher:
+    """Return the process-wide write batcher, creating it on first use or after a fork."""
+    global _batcher, _batcher_pid
+
+    with _batcher_lock:
+        if _batcher is None or _batcher_pid != os.getpid():
+            config = load_config()
+            _batcher = WriteBatcher(
+                max_operations=config.getint('MONGODB', 'write_batch_size', fallback=100),
+                max_delay=config.getfloat('MONGODB', 'write_batch_delay_seconds', fallback=5.0)
+            )
+            _batcher_pid = os.getpid()
+        return _batcher
+
+def flush_writes() -> int:
+    """Flush the buffered writes of this process, if any."""
+    with _batcher_lock:
+        if _batcher is None or _batcher_pid != os.getpid():
+            return 0
+        return _batcher.flush()
+
+atexit.register(flush_writes)
@@ -8,13 +8,18 @@ from utils.helper_functions import copy_file
 
 logger = logging.getLogger(__name__)
 
-config = load_config()
-folder_title = config.get('FIREFOX', 'folder_title')
-firefox_profile_path = config.get('FIREFOX', 'firefox_profile_path')
-local_firefox_path = config.get('FIREFOX', 'local_firefox_path')
+def load_firefox_config() -> dict:
+    """Load the Firefox profile settings when they are first needed rather than on import."""
+    config = load_config()
+    return {
+        'folder_title': config.get('FIREFOX', 'folder_title'),
+        'firefox_profile_path': config.get('FIREFOX', 'firefox_profile_path'),
+        'local_firefox_path': config.get('FIREFOX', 'local_firefox_path'),
+    }
 
 def find_firefox_profile():
     """Find the Firefox profile directory."""
+    firefox_profile_path = load_firefox_config()['firefox_profile_path']
     logger.debug(f"Starting search in: {firefox_profile_path}")
 
     if not os.path.exists(firefox_profile_path):
@@ -44,6 +49,7 @@ def setup_firefox():
         logger.error("Firefox profile not found.")
         return None
 
+    local_firefox_path = load_firefox_config()['local_firefox_path']
     places_src = Path(local_firefox_path) / 'places.sqlite'
     cookies_src = Path(local_firefox_path) / 'cookies.sqlite'
     places_dest = firefox_profile / 'places.sqlite'
@@ -62,6 +68,7 @@ def setup_firefox():
 
 def get_folder_id(cursor):
     """Retrieve the ID of a folder given its title."""
+    folder_title = load_firefox_config()['folder_title']
     try:
         cursor.execute("SELECT id FROM moz_bookmarks WHERE title=? AND type=2", (folder_title,))
         result = cursor.fetchone()
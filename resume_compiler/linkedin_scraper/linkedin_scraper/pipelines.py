@@ -1,6 +1,7 @@
 import logging
 from scrapy.exceptions import DropItem
-from database.db_helper_functions import get_client, load_mongodb_config
+from database.database_operations import STAGE_SCRAPED
+from database.db_helper_functions import get_client, load_mongodb_config, utc_now
 
 class MongoDBPipeline(object):
 
@@ -8,14 +9,14 @@ class MongoDBPipeline(object):
         self.mongo_config = load_mongodb_config()
     
     def open_spider(self, spider):
-        logging.info("Opening spider and setting up MongoDB client.")
+        logging.info("Opening spider and acquiring the shared MongoDB client.")
         self.client = get_client()
         self.db = self.client[self.mongo_config['database']]
         self.collection = self.db['job_postings']
     
     def close_spider(self, spider):
-        logging.info("Closing spider and shutting down MongoDB client.")
-        self.client.close()
+        # The client is shared process-wide and closed once at shutdown.
+        logging.info("Closing spider.")
 
     def validate_item(self, item):
         mandatory_fields = ['job_id', 'company', 'role', 'description', 'city']
@@ -40,6 +41,8 @@ class MongoDBPipeline(object):
             update_data = dict(item)
             update_data['general'] = False
             update_data['tailored'] = False
+            update_data['stage'] = STAGE_SCRAPED
+            update_data['updated_at'] = utc_now()
             update_operation = {'$set': update_data}
             
             logging.info(f"Upserting item into MongoDB for id: {item.get('job_id')}")
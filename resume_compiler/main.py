@@ -3,15 +3,45 @@ import sys
 from config.logging_config import setup_logging
 from firefox.profile_operations import get_bookmarks
 from database.backup_operations import check_and_import, clean_backups, export_backups
+from database.db_helper_functions import close_client
+from database.write_batcher import flush_writes
 from database.database_operations import (
+    RESUME_CRITERIA,
+    STAGE_DISCOVERED,
+    STAGE_SCRAPED,
     collect_new_job_postings,
-    find_documents_missing_field,
+    find_postings_in_stage,
+    find_skills_without_bullets,
+    has_documents,
     propagate_skills_field_across_docs,
 )
-from resume.achievements_builder import build_achievements
-from resume.tailor_resume import tailor_resume
-from resume.tailor_skills import tailor_skills
-from scraper.scrapy_helper_functions import run_job_scraper
+
+# Each stage imports its heavy dependencies (scrapy and twisted, openai and tiktoken, python-docx and PIL)
+# only when it has work, so runs with nothing to do for a stage never load them.
+
+def run_scrape_stage(job_ids: list):
+    if not job_ids:
+        return
+    from scraper.scrapy_helper_functions import run_job_scraper
+    run_job_scraper(job_ids)
+
+def run_skills_stage(job_ids: list):
+    if not job_ids:
+        return
+    from resume.tailor_skills import tailor_skills
+    tailor_skills(job_ids)
+
+def run_achievements_stage(skills: list):
+    if not skills:
+        return
+    from resume.achievements_builder import build_achievements
+    build_achievements(skills)
+
+def run_resume_stage():
+    if not has_documents('job_postings', RESUME_CRITERIA):
+        return
+    from resume.tailor_resume import tailor_resume
+    tailor_resume()
 
 def main():
 
@@ -26,22 +56,23 @@ def main():
 
     collect_new_job_postings(bookmark_urls)
 
-    postings_to_scrape = find_documents_missing_field('job_postings', 'job_id', 'description')
-    run_job_scraper(postings_to_scrape)
+    run_scrape_stage(find_postings_in_stage(STAGE_DISCOVERED))
 
     propagate_skills_field_across_docs()
 
-    postings_missing_skills = find_documents_missing_field('job_postings', 'job_id', 'skills')
-    tailor_skills(postings_missing_skills)
+    run_skills_stage(find_postings_in_stage(STAGE_SCRAPED))
+    flush_writes()
 
-    skills_missing_achievements = find_documents_missing_field('bullet_points', 'skill', 'bullets')
-    build_achievements(skills_missing_achievements)
+    run_achievements_stage(find_skills_without_bullets())
+    flush_writes()
 
-    tailor_resume()
+    run_resume_stage()
+    flush_writes()
 
     export_backups()
     clean_backups()
 
+    close_client()
     logger.info("Done")
 
 if __name__ == "__main__":
@@ -1,9 +1,15 @@
-from ai.openai_operations import create_chat_completion
+import logging
+
+from ai.openai_operations import create_chat_completion, generate_achievement_bullets
 from config.settings import load_config
 from database.database_operations import update_skill_bullets
 from utils.helper_functions import get_user_confirmation, line_fit
 
+logger = logging.getLogger(__name__)
+
 VERBS = ["built", "led", "managed", "collaborated", "improved"]
+# Requests for one skill's bullets per run, counting re-runs of unusable answers.
+ACHIEVEMENT_ATTEMPTS = 3
 
 config = load_config()
 achievement_length_limit = config["RESUME"]["achievement_length_limit"]
@@ -12,12 +18,20 @@ def build_achievements(skills: list):
     """Generate and store achievement bullet points for a list of skills."""
     for skill in skills:
         achievements = generate_achievements(skill)
+        if achievements is None:
+            logger.warning(f"No usable achievements for skill '{skill}' after {ACHIEVEMENT_ATTEMPTS} attempts, leaving it for a later run.")
+            continue
         verified_achievements = verify_achievements(skill, achievements)
         update_skill_bullets(skill, verified_achievements)
 
 def generate_achievements(skill):
-    response = create_chat_completion("build_achievements", skill, temperature=0.8)
-    return response.split("^_^")
+    """Return achievement bullets for a skill, or None if ACHIEVEMENT_ATTEMPTS answers were unusable."""
+    achievements = generate_achievement_bullets(skill, len(VERBS))
+    for _ in range(ACHIEVEMENT_ATTEMPTS - 1):
+        if achievements is not None:
+            break
+        achievements = generate_achievement_bullets(skill, len(VERBS), use_cache=False)
+    return achievements
 
 def verify_achievements(skill, achievements):
     verified_achievements = {}
@@ -29,10 +43,10 @@ def verify_achievements(skill, achievements):
                     verified_achievements[verb] = achievement
                     break
                 else:
-                    more_relevant_achievements = [
-                        create_chat_completion("new_resume_bullet_point", f"**Skill**: {skill}\n**Verb**: {verb}", temperature=0.8)
-                        for _ in range(10)
-                    ]
+                    # Sample ten suggestions in one request; near-duplicates are dropped.
+                    more_relevant_achievements = create_chat_completion(
+                        "new_resume_bullet_point", f"**Skill**: {skill}\n**Verb**: {verb}", temperature=0.8, use_cache=False, n=10
+                    )
                     for i, more_relevant_achievement in enumerate(more_relevant_achievements):
                         print(f"More relevant example achievement {i+1}: {more_relevant_achievement}")
 
@@ -8,8 +8,8 @@ from os.path import join
 from collections import defaultdict
 
 from config.settings import load_config
-from database.database_operations import get_documents
-from utils.helper_functions import get_user_confirmation, line_fit, sanitize_filename
+from database.database_operations import RESUME_CRITERIA, iter_documents
+from utils.helper_functions import get_user_confirmation, line_fit, parse_skills, sanitize_filename
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +21,7 @@ skill_length_limit = config["RESUME"]["skill_length_limit"]
 
 def prepare_skills_list(skills):
     logger.debug(f"Preparing skills list from: {skills}")
-    skills_list = skills.split('^_^')
+    skills_list = parse_skills(skills)
     return (skills_list * ((15 // len(skills_list)) + 1))[:15] if len(skills_list) < 15 else skills_list[:15]
 
 def generate_output_filename(role, company, current_date):
@@ -169,9 +169,8 @@ def save_pdf(doc_path, role, company, date):
 
 def fetch_new_jobs():
     logger.info("Fetching new jobs from the database.")
-    criteria = {'$and': [{'tailored': False}, {'general': False}]}
     fields = ['job_id', 'company', 'role', 'skills', 'city']
-    return get_documents('job_postings', criteria, fields)
+    return iter_documents('job_postings', RESUME_CRITERIA, fields)
 
 def extract_job_details(new_job):
     logger.debug(f"Extracting job details from job: {new_job}")
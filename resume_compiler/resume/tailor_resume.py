@@ -4,7 +4,7 @@ from docx import Document
 from os.path import exists
 
 from config.settings import load_config
-from database.database_operations import get_aggregated_data, score_bullet_quality, update_field, update_many_fields
+from database.database_operations import STAGE_TAILORED, advance_stage, iter_aggregated_data, score_bullet_quality, update_many_fields
 from resume.resume_helper_functions import (
     build_output_path, extract_job_details, fetch_new_jobs, 
     format_aggregated_data, generate_job_url, generate_output_filename,
@@ -15,6 +15,9 @@ from utils.helper_functions import config_exists, get_current_date
 
 logger = logging.getLogger(__name__)
 
+# Profile picks for one job per run, counting re-runs of unusable or unknown profiles.
+PROFILE_ATTEMPTS = 3
+
 config = load_config()
 
 def display_dict(d):
@@ -127,17 +130,10 @@ def aggregate_skill_bullets(skills):
     logger.debug(f"Aggregating skill bullets for skills: {top_skills}")
     pipeline = [
         {'$match': {'skill': {'$in': top_skills}}},
-        {'$unwind': '$bullets'},
-        {'$project': {
-            '_id': 1,
-            'skill': 1,
-            'verb': '$bullets.verb',
-            'bullet': '$bullets.bullet',
-            'quality': '$bullets.quality'
-        }},
+        {'$project': {'_id': 1, 'skill': 1, 'verb': 1, 'bullet': 1, 'quality': 1}},
         {'$sort': {'skill': 1, 'verb': 1}}
     ]
-    agg = get_aggregated_data("bullet_points", pipeline)
+    agg = iter_aggregated_data("bullets", pipeline)
     aggregated_data = format_aggregated_data(agg, top_skills)
     scored_aggregate = score_bullet_quality(aggregated_data)
     logger.debug(f"Aggregated data: {scored_aggregate}")
@@ -174,11 +170,14 @@ def tailor_resume():
             logger.warning(f"Resume '{output_filename}' already exists.")
             continue
         
-        while True:
-            profile = pick_a_hat(role)
-            if config_exists(config, "RESUME", f"{profile}_template"):
+        for attempt in range(PROFILE_ATTEMPTS):
+            profile = pick_a_hat(role, use_cache=attempt == 0)
+            if profile and config_exists(config, "RESUME", f"{profile}_template"):
                 break
             logger.warning(f"Could not find profile: '{profile}' in config.")
+        else:
+            logger.warning(f"No usable profile for job id {job_id} after {PROFILE_ATTEMPTS} attempts, leaving it for a later run.")
+            continue
 
         template_path = config["RESUME"][f"{profile}_template"]
         template = Document(template_path)
@@ -192,6 +191,6 @@ def tailor_resume():
         update_resume(template, role, city, full_url, skills_list, summary_of_achievements)
         save_resume(template, output_path)
         save_pdf(output_path, role, company, current_date)
-        update_many_fields("bullet_points", "bullets.bullet", {"$in": summary_of_achievements}, "bullets.$[elem].resume_reference", datetime.now(), [{ "elem.bullet": {"$in": summary_of_achievements} }])
-        update_field("job_postings", "job_id", job_id, "tailored", True)
+        update_many_fields("bullets", "bullet", {"$in": summary_of_achievements}, "resume_reference", datetime.now())
+        advance_stage(job_id, STAGE_TAILORED, {"tailored": True})
         logger.info(f"Tailored resume created and saved as '{output_path}' and PDF version.")
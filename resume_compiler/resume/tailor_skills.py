@@ -1,8 +1,11 @@
 import logging
 from typing import List
-from ai.openai_operations import create_chat_completion, skills_analysis
+from ai.batch_operations import load_batch_config, skills_analysis_batch
+from ai.openai_operations import SKILLS_COUNT, capitalize_skills, close_skills_analysis, create_chat_completion, skills_analysis
 from config.settings import load_config
-from database.database_operations import get_documents, insert_skill, update_field
+from database.database_operations import STAGE_SKILLS_READY, advance_stage, iter_documents
+from database.db_helper_functions import get_cursor_batch_size
+from database.skill_registry import get_skill_registry
 from utils.helper_functions import get_user_confirmation, line_fit
 
 logger = logging.getLogger(__name__)
@@ -11,46 +14,100 @@ config = load_config()
 robo_tailor = eval(config["AUTOMATION"]["automate_skills"])
 skill_length_limit = config["RESUME"]["skill_length_limit"]
 
+REPLACEMENT_CANDIDATES = 5
+# Analyses of one posting per run, counting re-runs of answers without 15 skills.
+SKILLS_ANALYSIS_ATTEMPTS = 3
+# Requests per replacement skill or capitalization of one posting, counting re-runs of unusable answers.
+SKILL_PROMPT_ATTEMPTS = 3
+skill_match_threshold = config.getfloat("SKILL_MATCHER", "match_threshold", fallback=0.8)
+skill_shortlist_size = config.getint("SKILL_MATCHER", "shortlist_size", fallback=20)
+
+def iter_job_descriptions(job_ids: list, batch_size: int):
+    """Yield (job_id, description) pairs of the given postings."""
+    criteria = {"job_id": {"$in": job_ids}}
+    fields = ["job_id", "description"]
+    for doc in iter_documents('job_postings', criteria, fields, batch_size):
+        if "description" in doc:
+            yield doc["job_id"], doc["description"]
+
 def tailor_skills(job_ids: list):
-    """Perform skills analysis on a list of job IDs."""
+    """Perform skills analysis on a list of job IDs, streaming descriptions in batches.
+    In batch mode a large backlog goes through the Batch API instead, and postings waiting in a
+    running batch are left for the run that collects it."""
     logger.info("Starting skill tailoring for job ids: %s", job_ids)
-    all_job_descriptions = {}
+    batch_size = get_cursor_batch_size()
+
+    if load_batch_config()['enabled']:
+        job_skills, pending_job_ids = skills_analysis_batch(job_ids, lambda ids: iter_job_descriptions(ids, batch_size))
+        job_skills = {job_id: skills for job_id, skills in job_skills.items() if job_id in job_ids}
+        valid_skills, _ = partition_skills(job_skills)
+        if valid_skills:
+            save_skills(valid_skills)
+        job_ids = [job_id for job_id in job_ids if job_id not in pending_job_ids and job_id not in valid_skills]
+
+    # All batches share one analysis loop, so rate limits learned in one batch still apply in the next.
+    try:
+        job_descriptions = {}
+        for job_id, description in iter_job_descriptions(job_ids, batch_size):
+            job_descriptions[job_id] = description
+            if len(job_descriptions) >= batch_size:
+                tailor_skills_batch(job_descriptions)
+                job_descriptions = {}
+
+        if job_descriptions:
+            tailor_skills_batch(job_descriptions)
+    finally:
+        close_skills_analysis()
+
+def partition_skills(job_skills: dict) -> tuple:
+    """Split analysis results into valid 15-skill lists and the job IDs whose answer needs another attempt."""
     valid_skills = {}
+    invalid_skills_job_ids = []
+    for job_id, skills in job_skills.items():
+        skills = skills or []
+        if len(skills) == SKILLS_COUNT:
+            valid_skills[job_id] = skills
+        else:
+            invalid_skills_job_ids.append(job_id)
+    return valid_skills, invalid_skills_job_ids
+
+def save_skills(valid_skills: dict):
+    logger.info("Mapped job descriptions to skills: %s", valid_skills)
+    if robo_tailor:
+        collect_skills(valid_skills)
+    else:
+        verify_skills(valid_skills)
+
+def tailor_skills_batch(job_descriptions: dict):
+    """Perform skills analysis on a batch of job descriptions keyed by job ID.
+    Answers without 15 skills are re-run, up to SKILLS_ANALYSIS_ATTEMPTS analyses in all. Postings whose
+    request failed or that got no usable answer stay in the scraped stage for a later run."""
+    valid_skills = {}
+    use_cache = True
 
     try:
-        while job_ids:
-            criteria = {"job_id": {"$in": job_ids}}
-            fields = ["job_id", "description"]
-            job_listings = get_documents('job_postings', criteria, fields)
-            logger.debug("Fetched job listings: %s", job_listings)
-
-            job_descriptions = {doc["job_id"]: doc["description"] for doc in job_listings if "description" in doc}
-            all_job_descriptions.update(job_descriptions)
-            logger.debug("Extracted job descriptions: %s", job_descriptions)
-
-            job_skills = skills_analysis(job_descriptions)
-
-            invalid_skills_job_ids = [
-                job_id for job_id, skills in job_skills.items()
-                if len(skills.split('^_^')[:15]) != 15
-            ]
-
-            for job_id, skills in job_skills.items():
-                if job_id not in invalid_skills_job_ids:
-                    skills = skills.split('^_^')[:15]
-                    valid_skills[job_id] = ('^_^').join(skills)
-
-            if invalid_skills_job_ids:
-                logger.warning("Some skills did not meet the criteria, re-running analysis for job ids: %s", invalid_skills_job_ids)
-                job_ids = invalid_skills_job_ids
-            else:       
-                logger.info("Mapped job descriptions to skills: %s", valid_skills)
-                if robo_tailor:
-                    collect_skills(valid_skills)
-                else:
-                    verify_skills(valid_skills)
+        for attempt in range(SKILLS_ANALYSIS_ATTEMPTS):
+            if attempt:
+                logger.warning("Some skills did not meet the criteria, re-running analysis for job ids: %s", list(job_descriptions))
+                # The cached answers were rejected, so ask the API again.
+                use_cache = False
+            logger.debug("Analyzing job descriptions: %s", list(job_descriptions))
+            job_skills, failed_job_ids = skills_analysis(job_descriptions, use_cache)
+            if failed_job_ids:
+                logger.warning("Skills analysis failed, leaving job ids for a later run: %s", failed_job_ids)
+
+            valid_batch_skills, invalid_skills_job_ids = partition_skills(job_skills)
+            valid_skills.update(valid_batch_skills)
+
+            job_descriptions = {job_id: job_descriptions[job_id] for job_id in invalid_skills_job_ids}
+            if not job_descriptions:
                 break
 
+        if job_descriptions:
+            logger.warning("No usable skills after %d attempts, leaving job ids for a later run: %s", SKILLS_ANALYSIS_ATTEMPTS, list(job_descriptions))
+        if valid_skills:
+            save_skills(valid_skills)
+
     except Exception as e:
         logger.error("Error during skills analysis: %s", e)
         raise
@@ -83,7 +140,7 @@ def verify_single_skill(skill):
             skill = get_replacement_skill(skill)
             replacement_flag = True
         skill = ensure_skill_fits_length(skill)
-        insert_skill(skill)
+        get_skill_registry().add(skill)
         logger.info("Verified and inserted skill: %s", skill)
     except Exception as e:
         logger.error("Error verifying single skill '%s': %s", skill, e)
@@ -95,11 +152,10 @@ def verify_skills(job_skills):
     for job_id, skills in job_skills.items():
         logger.info("Verifying skills for job id: %s", job_id)
         
-        skills_list = skills.split("^_^")
         verified_skills = []
         replacement_skills = []
 
-        for skill in skills_list:
+        for skill in skills:
             verified_skill, replacement_flag = verify_single_skill(skill)
             if replacement_flag:
                 replacement_skills.append(verified_skill)
@@ -108,78 +164,108 @@ def verify_skills(job_skills):
             chosen_skills = verified_skills + replacement_skills
             print(f"Verified skills so far: {chosen_skills}")
 
-        chosen_skills_str = '^_^'.join(chosen_skills)
-        update_field("job_postings", "job_id", job_id, "skills", chosen_skills_str)
-        logger.info("Updated job id %s with skills: %s", job_id, chosen_skills_str)
+        advance_stage(job_id, STAGE_SKILLS_READY, {"skills": chosen_skills})
+        logger.info("Updated job id %s with skills: %s", job_id, chosen_skills)
 
 def are_skills_valid(replacement_skills_list):
     unique_skills = list({skill for skill in replacement_skills_list})
     return len(unique_skills) == 15
 
+def choose_replacement_skill(skill, skill_collection, use_cache=True):
+    """Ask for several replacement candidates in one request and return the first one in the collection, or None."""
+    prompt = (
+        f"Inputted skill: {skill}\n\n"
+        f"Skill collection: {'^_^'.join(skill_collection)}"
+    )
+    candidates = create_chat_completion("collect_skills", prompt, temperature=0.7, use_cache=use_cache, n=REPLACEMENT_CANDIDATES)
+    return next((candidate.strip() for candidate in candidates if candidate.strip() in skill_collection), None)
+
+def find_replacement_skill(skill, skill_collection, use_cache=True):
+    """Return the closest available skill from the collection. A confident local match needs no request;
+    otherwise the model chooses from a shortlist of the closest skills. Returns None if it picks none of them."""
+    # Search past the shortlist size since some of the closest skills may already be used.
+    matches = [
+        (match, score) for match, score in get_skill_registry().search(skill, skill_shortlist_size * 3)
+        if match in skill_collection and match != skill
+    ][:skill_shortlist_size]
+    if matches and matches[0][1] >= skill_match_threshold:
+        logger.info("Matched skill '%s' to '%s' locally (similarity %.2f)", skill, matches[0][0], matches[0][1])
+        return matches[0][0]
+    shortlist = [match for match, _ in matches] or skill_collection
+    return choose_replacement_skill(skill, shortlist, use_cache)
+
+def find_replacement_skill_with_retries(skill, skill_collection):
+    """Return a replacement skill, or None if SKILL_PROMPT_ATTEMPTS answers picked none of the shortlist."""
+    replacement_skill = find_replacement_skill(skill, skill_collection)
+    for _ in range(SKILL_PROMPT_ATTEMPTS - 1):
+        if replacement_skill is not None:
+            break
+        replacement_skill = find_replacement_skill(skill, skill_collection, use_cache=False)
+    return replacement_skill
+
+def capitalize_skills_with_retries(skills):
+    """Return the skills capitalized, or None if SKILL_PROMPT_ATTEMPTS answers were unusable."""
+    capitalized_skills_list = capitalize_skills(skills)
+    for _ in range(SKILL_PROMPT_ATTEMPTS - 1):
+        if capitalized_skills_list is not None:
+            break
+        logger.warning("AI failed to capitalize skills")
+        capitalized_skills_list = capitalize_skills(skills, use_cache=False)
+    return capitalized_skills_list
+
+def verify_job_skills(job_id, skills, skill_collection):
+    """Map a posting's skills onto the skill collection, replacing missing ones and topping the list up
+    to 15. Returns None if a replacement could not be found."""
+    verified_skills = []
+
+    for skill in skills:
+        skill = skill.lower()
+        if skill in skill_collection:
+            verified_skills.append(skill)
+            skill_collection.remove(skill)
+        else:
+            logger.info("Found missing skills for job id %s: %s", job_id, skill)
+            replacement_skill = find_replacement_skill_with_retries(skill, skill_collection)
+            if replacement_skill is None:
+                return None
+            verified_skills.append(replacement_skill)
+            skill_collection.remove(replacement_skill)
+
+    while len(verified_skills) < 15:
+        for skill in verified_skills:
+            logger.info("Not enough skills for job id %s", job_id)
+            replacement_skill = find_replacement_skill_with_retries(skill, skill_collection)
+            if replacement_skill is None:
+                return None
+            verified_skills.append(replacement_skill)
+            skill_collection.remove(replacement_skill)
+            if len(verified_skills) < 15:
+                break
+
+    return verified_skills
+
 def collect_skills(job_skills):
-    fields = ["skill"]
+    """Store the verified, capitalized skills of each posting. Postings whose prompts give no usable answer
+    within SKILL_PROMPT_ATTEMPTS are left for a later run."""
+    skill_registry = get_skill_registry()
     try:
-        for job_id, skills_str in job_skills.items():
-            skill_collection = {
-                doc["skill"].lower()
-                for doc in get_documents('bullet_points', {}, fields)
-                if "skill" in doc
-            }
+        for job_id, skills in job_skills.items():
+            skill_collection = skill_registry.skills()
             logger.debug("Collected existing skills: %s", skill_collection)
 
-            verified_skills = []
-
-            skills = skills_str.split("^_^")
-            for skill in skills:
-                skill = skill.lower()
-                if skill in skill_collection:
-                    verified_skills.append(skill)
-                    skill_collection.remove(skill)
-                else:
-                    replacement_skill = skill
-                    while replacement_skill not in skill_collection:
-                        logger.info("Found missing skills for job id %s: %s", job_id, skill)
-                        prompt = (
-                            f"Inputted skill: {skill}\n\n"
-                            f"Skill collection: {'^_^'.join(skill_collection)}"
-                        )
-                        replacement_skill = create_chat_completion("collect_skills", prompt, temperature=0.7)
-                    verified_skills.append(replacement_skill)
-                    skill_collection.remove(replacement_skill)
-
-            while len(verified_skills) < 15:
-                for skill in verified_skills:
-                    logger.info("Not enough skills for job id %s", job_id)
-                    prompt = (
-                        f"Inputted skill: {skill}\n\n"
-                        f"Skill collection: {'^_^'.join(skill_collection)}"
-                    )
-                    replacement_skill = create_chat_completion("collect_skills", prompt, temperature=0.7)
-                    while replacement_skill not in skill_collection:
-                        logger.info("Adding additional skill for job id %s", job_id)
-                        prompt = (
-                            f"Inputted skill: {skill}\n\n"
-                            f"Skill collection: {'^_^'.join(skill_collection)}"
-                        )
-                        replacement_skill = create_chat_completion("collect_skills", prompt, temperature=0.7)
-                    verified_skills.append(replacement_skill)
-                    skill_collection.remove(replacement_skill)
-                    if len(verified_skills) < 15:
-                        break
-
+            verified_skills = verify_job_skills(job_id, skills, skill_collection)
+            if verified_skills is None:
+                logger.warning("No usable replacement skill after %d attempts, leaving job id for a later run: %s", SKILL_PROMPT_ATTEMPTS, job_id)
+                continue
             logger.info("Verified skills for job id %s: %s", job_id, verified_skills)
 
-            updated_job_skills = "^_^".join(verified_skills)
-            capitalized_skills = create_chat_completion("capitalize_skills", updated_job_skills, temperature=0.4)
-            capitalized_skills_list = capitalized_skills.split("^_^")[:15]
-            while len(capitalized_skills_list) != 15:
-                logger.warning("AI failed to capitalize skills")
-                capitalized_skills = create_chat_completion("capitalize_skills", updated_job_skills, temperature=0.4)
-                capitalized_skills_list = capitalized_skills.split("^_^")[:15]
-                capitalized_skills = "^_^".join(capitalized_skills_list)
-
-            update_field("job_postings", "job_id", job_id, "skills", capitalized_skills)
-            logger.info("Updated job id %s with new skills collection: %s", job_id, capitalized_skills)
+            capitalized_skills_list = capitalize_skills_with_retries(verified_skills)
+            if capitalized_skills_list is None:
+                logger.warning("No usable capitalization after %d attempts, leaving job id for a later run: %s", SKILL_PROMPT_ATTEMPTS, job_id)
+                continue
+
+            advance_stage(job_id, STAGE_SKILLS_READY, {"skills": capitalized_skills_list})
+            logger.info("Updated job id %s with new skills collection: %s", job_id, capitalized_skills_list)
 
     except Exception as e:
         logger.error("Error collecting skills: %s", e)
@@ -3,7 +3,6 @@ from re import sub
 from datetime import datetime
 from urllib.parse import urlparse
 from shutil import copyfile, SameFileError, SpecialFileError
-from PIL import ImageFont, ImageDraw, Image
 
 logger = logging.getLogger(__name__)
 
@@ -43,12 +42,23 @@ def get_job_id_from_url(url: str) -> str:
     except (ValueError, IndexError):
         return None
     
+def parse_skills(skills) -> list:
+    """Return skills as a list, accepting the legacy '^_^'-joined string format."""
+    if not skills:
+        return []
+    if isinstance(skills, str):
+        return skills.split('^_^')
+    return list(skills)
+
 def ids_to_urls(ids):
     """Returns a list of LinkedIn job URLs give a list of ids."""
     base_url = "https://www.linkedin.com/jobs-guest/jobs/api/jobPosting/"
     return [f"{base_url}{id}" for id in ids]
 
 def line_fit(text, line, font_name='arial', font_size=10):
+    # Pillow is only needed by the stages that measure text, so it is not loaded on startup.
+    from PIL import ImageFont, ImageDraw, Image
+
     try:
         font = ImageFont.truetype(f"{font_name}.ttf", font_size)
     except IOError:
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 3
+NON_SKILL_CHARACTERS = re.compile(r'[^a-z0-9+#./ ]+')
+
+def normalize_skill(skill: str) -> str:
+    """Lower-case a skill and reduce punctuation and spacing, keeping characters that matter in names like c++, c# and .net."""
+    return ' '.join(NON_SKILL_CHARACTERS.sub(' ', skill.lower()).split())
+
+def char_ngrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + NGRAM_SIZE] for i in range(max(len(padded) - NGRAM_SIZE + 1, 1)))
+
+def load_aliases(path: str) -> dict:
+    """Load the alias table mapping alternative spellings to the canonical skill name."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return {normalize_skill(alias): normalize_skill(skill) for alias, skill in json.load(file).items()}
+
+class SkillMatcher:
+    """Character n-gram TF-IDF index over a skill vocabulary with top-k cosine search.
+
+    Term frequencies are kept as coordinate arrays (row = skill, column = n-gram) that only grow, so adding
+    skills is cheap. IDF weights, row norms and the per-n-gram posting lists are recomputed lazily, with
+    vectorized NumPy operations, on the first search after a change."""
+
+    def __init__(self, skills=(), aliases: dict = None):
+        self.aliases = aliases or {}
+        self.skills = []
+        self._skill_rows = {}
+        self._ngram_columns = {}
+        self._rows = np.empty(0, dtype=np.int32)
+        self._columns = np.empty(0, dtype=np.int32)
+        self._counts = np.empty(0, dtype=np.float32)
+        self._document_frequency = np.empty(0, dtype=np.float32)
+        self._dirty = True
+        self.add_many(skills)
+
+    def __len__(self) -> int:
+        return len(self.skills)
+
+    def add_many(self, skills):
+        """Add skills to the index, skipping ones already present."""
+        rows, columns, counts = [], [], []
+        for skill in skills:
+            key = normalize_skill(skill)
+            if not key or key in self._skill_rows:
+                continue
+            row = len(self.skills)
+            self._skill_rows[key] = row
+            self.skills.append(skill)
+            for ngram, count in char_ngrams(key).items():
+                column = self._ngram_columns.setdefault(ngram, len(self._ngram_columns))
+                rows.append(row)
+                columns.append(column)
+                counts.append(count)
+        if not rows:
+            return
+
+        columns = np.asarray(columns, dtype=np.int32)
+        self._rows = np.concatenate([self._rows, np.asarray(rows, dtype=np.int32)])
+        self._columns = np.concatenate([self._columns, columns])
+        self._counts = np.concatenate([self._counts, np.asarray(counts, dtype=np.float32)])
+        frequency = np.zeros(len(self._ngram_columns), dtype=np.float32)
+        frequency[:len(self._document_frequency)] = self._document_frequency
+        frequency += np.bincount(columns, minlength=len(self._ngram_columns))
+        self._document_frequency = frequency
+        self._dirty = True
+
+    def add(self, skill: str):
+        self.add_many([skill])
+
+    def _refresh(self):
+        """Recompute IDF weights, row norms and the posting lists sorted by n-gram."""
+        skill_count = len(self.skills)
+        self._idf = np.log((1 + skill_count) / (1 + self._document_frequency)) + 1
+        weights = self._counts * self._idf[self._columns]
+        self._norms = np.sqrt(np.bincount(self._rows, weights=weights ** 2, minlength=skill_count))
+        order = np.argsort(self._columns, kind='stable')
+        self._posting_rows = self._rows[order]
+        self._posting_weights = weights[order]
+        self._posting_starts = np.concatenate([[0], np.cumsum(np.bincount(self._columns, minlength=len(self._ngram_columns)))])
+        self._dirty = False
+
+    def search(self, query: str, k: int = 10) -> list:
+        """Return up to k (skill, cosine similarity) pairs with a positive score, best first.
+        An exact or alias match scores 1.0. Aliases only apply to queries that are not skills themselves."""
+        key = normalize_skill(query)
+        if key not in self._skill_rows:
+            key = self.aliases.get(key, key)
+        if not self.skills or not key:
+            return []
+        if self._dirty:
+            self._refresh()
+
+        query_ngrams = [(self._ngram_columns[ngram], count) for ngram, count in char_ngrams(key).items() if ngram in self._ngram_columns]
+        if not query_ngrams:
+            return []
+        rows, weights = [], []
+        query_norm = 0.0
+        for column, count in query_ngrams:
+            query_weight = count * self._idf[column]
+            start, end = self._posting_starts[column], self._posting_starts[column + 1]
+            rows.append(self._posting_rows[start:end])
+            weights.append(self._posting_weights[start:end] * query_weight)
+            query_norm += query_weight ** 2
+        # N-grams missing from the vocabulary still count towards the query's length.
+        for ngram, count in char_ngrams(key).items():
+            if ngram not in self._ngram_columns:
+                query_norm += (count * self._idf.max()) ** 2
+
+        scores = np.bincount(np.concatenate(rows), weights=np.concatenate(weights), minlength=len(self.skills))
+        scores /= self._norms * np.sqrt(query_norm)
+        exact_row = self._skill_rows.get(key)
+        if exact_row is not None:
+            scores[exact_row] = 1.0
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.skills[row], float(scores[row])) for row in top if scores[row] > 0]
+
+    def match(self, query: str, threshold: float):
+        """Return the best matching skill if its similarity reaches threshold, otherwise None."""
+        results = self.search(query, 1)
+        if results and results[0][1] >= threshold:
+            return results[0][0]
+        return None
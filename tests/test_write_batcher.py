@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resume_compiler'))
+
+from pymongo import InsertOne, errors
+
+from database import write_batcher
+from database.write_batcher import WriteBatcher, WriteBatchError
+
+class FakeCollection:
+    """Records bulk writes and, like MongoDB, stops an ordered bulk write at the first rejected operation."""
+
+    def __init__(self, written: list, rejected=(), fail_with=None):
+        self.written = written
+        self.rejected = rejected
+        self.fail_with = fail_with
+
+    def bulk_write(self, operations, ordered=True):
+        if self.fail_with is not None:
+            raise self.fail_with
+        for index, operation in enumerate(operations):
+            if operation._doc['value'] in self.rejected:
+                raise errors.BulkWriteError({
+                    'writeErrors': [{'index': index, 'code': 11000, 'errmsg': 'E11000 duplicate key error'}],
+                    'nInserted': index,
+                })
+            self.written.append(operation._doc['value'])
+
+class WriteBatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.written = {'first': [], 'second': []}
+        self.collections = {name: FakeCollection(written) for name, written in self.written.items()}
+        patcher = mock.patch.object(write_batcher, 'get_collection', lambda name: self.collections[name])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rejected_operation_does_not_drop_other_writes(self):
+        self.collections['first'].rejected = {2}
+        batcher = WriteBatcher(max_operations=100)
+        for value in range(5):
+            batcher.add('first', InsertOne({'value': value}))
+        batcher.add('second', InsertOne({'value': 'a'}))
+        batcher.add('first', InsertOne({'value': 5}))
+
+        with self.assertRaises(WriteBatchError) as raised:
+            batcher.flush()
+
+        self.assertEqual(self.written['first'], [0, 1, 3, 4, 5])
+        self.assertEqual(self.written['second'], ['a'])
+        self.assertEqual(len(raised.exception.failures), 1)
+        self.assertEqual(len(batcher), 0)
+
+    def test_rejection_during_add_is_raised_by_the_next_flush(self):
+        self.collections['first'].rejected = {0}
+        batcher = WriteBatcher(max_operations=2)
+        batcher.add('first', InsertOne({'value': 0}))
+        batcher.add('second', InsertOne({'value': 'a'}))
+
+        self.assertEqual(self.written['second'], ['a'])
+        with self.assertRaises(WriteBatchError):
+            batcher.flush()
+        self.assertEqual(batcher.flush(), 0)
+
+    def test_unsent_operations_stay_queued_after_a_connection_error(self):
+        self.collections['second'].fail_with = errors.AutoReconnect('connection lost')
+        batcher = WriteBatcher(max_operations=100)
+        batcher.add('first', InsertOne({'value': 0}))
+        batcher.add('second', InsertOne({'value': 'a'}))
+        batcher.add('first', InsertOne({'value': 1}))
+
+        with self.assertRaises(errors.AutoReconnect):
+            batcher.flush()
+        self.assertEqual(self.written['first'], [0])
+        self.assertEqual(len(batcher), 2)
+
+        self.collections['second'].fail_with = None
+        self.assertEqual(batcher.flush(), 2)
+        self.assertEqual(self.written['first'], [0, 1])
+        self.assertEqual(self.written['second'], ['a'])
+
+if __name__ == '__main__':
+    unittest.main()